@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""Throughput of the events API on the MySQL and SQLite backends.
+
+Runs the same workload against a scratch database on each backend: single and
+batched inserts, status lookups, and claiming then completing every event:
+
+    python -m benchmarks.db_backends --events 100000 --backends mysql sqlite
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from lib import db
+from benchmarks.db_indexes import DEVICES, INTERFACES
+
+
+def make_events(count):
+    now = int(time.time())
+    return [db.Event(now, random.choice(DEVICES), random.choice(INTERFACES))
+            for _ in range(count)]
+
+
+def rate(count, started):
+    return count / max(time.perf_counter() - started, 1e-9)
+
+
+def run(db_conn, events, singles):
+    """ Gets the operations per second of each part of the workload. """
+    results = {}
+
+    started = time.perf_counter()
+    for event in make_events(singles):
+        db_conn.insert_event(event)
+    results['insert_event'] = rate(singles, started)
+
+    batch = make_events(events)
+    started = time.perf_counter()
+    for start in range(0, len(batch), db.BATCH_SIZE):
+        db_conn.insert_events(batch[start:start + db.BATCH_SIZE])
+    results['insert_events'] = rate(len(batch), started)
+
+    lookups = 200
+    started = time.perf_counter()
+    for _ in range(lookups):
+        db_conn.get_events_by_status(db.Event.STATUS_CODES['QUEUED'], limit=100)
+        db_conn.session.commit()
+    results['get_events_by_status'] = rate(lookups, started)
+
+    claimed = 0
+    started = time.perf_counter()
+    while True:
+        claim = db_conn.claim_events(worker='bench', limit=64)
+        if not claim:
+            break
+        event_ids = [event.event_id for event in claim]
+        db_conn.update_results(event_ids, db.Event.RESULT_CODES['SUCCESS'])
+        db_conn.update_statuses(event_ids, db.Event.STATUS_CODES['PROCESSED'])
+        claimed += len(claim)
+    results['claim+complete'] = rate(claimed, started)
+    return results
+
+
+def scratch_db(name, db_name, directory):
+    """ Opens an empty, migrated database on the named backend. """
+    if name == 'sqlite':
+        backend = db.SqliteBackend(os.path.join(directory, '{}.db'.format(db_name)))
+    else:
+        with db.Db() as db_conn:
+            db_conn.create_database(db_name)
+        backend = db.MysqlBackend(db_name=db_name)
+
+    db_conn = db.Db(db_name=db_name, backend=backend)
+    db_conn.open_session()
+    cursor = db_conn.session.cursor()
+    cursor.execute('DROP TABLE IF EXISTS events')
+    cursor.execute('DROP TABLE IF EXISTS schema_version')
+    db_conn.migrate()
+    return db_conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--singles', type=int, default=2000)
+    parser.add_argument('--backends', nargs='+', default=['mysql', 'sqlite'],
+                        choices=['mysql', 'sqlite'])
+    parser.add_argument('--db-name', default='sdn_bench')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.backends:
+            db_conn = scratch_db(name, args.db_name, directory)
+            try:
+                results[name] = run(db_conn, args.events, args.singles)
+            finally:
+                db_conn.close_session()
+
+    print('{:<24}'.format('ops/s') + ''.join('{:>14}'.format(name) for name in results))
+    for operation in next(iter(results.values())):
+        print('{:<24}'.format(operation) +
+              ''.join('{:>14.0f}'.format(results[name][operation]) for name in results))
+
+
+if __name__ == '__main__':
+    main()
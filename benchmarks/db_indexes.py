@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""Query latency of the hot events queries before and after the index migration.
+
+Builds a synthetic events table in a scratch database, times the queries at
+schema version 2 (primary key only), applies the remaining migrations and times
+them again:
+
+    python -m benchmarks.db_indexes --rows 2000000
+"""
+
+import argparse
+import random
+import time
+from lib import db
+
+
+DEVICES = ['pe{:03d}.example.com'.format(number) for number in range(200)]
+INTERFACES = ['Ethernet{}/{}'.format(slot, port) for slot in range(1, 5) for port in range(1, 49)]
+
+
+def populate(db_conn, rows):
+    """ Inserts rows synthetic events, mostly PROCESSED with a small QUEUED tail. """
+    queued = db.Event.STATUS_CODES['QUEUED']
+    processed = db.Event.STATUS_CODES['PROCESSED']
+    now = int(time.time())
+    batch = []
+    for number in range(rows):
+        status = queued if number >= rows - rows // 1000 else processed
+        batch.append(db.Event(now - rows + number, random.choice(DEVICES),
+                              random.choice(INTERFACES), status=status))
+        if len(batch) == db.BATCH_SIZE:
+            db_conn.insert_events(batch)
+            batch = []
+    if batch:
+        db_conn.insert_events(batch)
+
+
+def measure(db_conn, repeat):
+    """ Gets the median latency in milliseconds of each hot query. """
+    queries = {
+        'get_events_by_status': lambda: db_conn.get_events_by_status(
+            db.Event.STATUS_CODES['QUEUED'], limit=100),
+        'get_event_id': lambda: db_conn.get_event_id(db.Event(
+            0, random.choice(DEVICES), random.choice(INTERFACES))),
+        'requeue_expired': lambda: db_conn.requeue_expired(),
+    }
+    results = {}
+    for name, query in queries.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            samples.append((time.perf_counter() - started) * 1000)
+            db_conn.session.commit()
+        samples.sort()
+        results[name] = samples[len(samples) // 2]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--db-name', default='sdn_bench')
+    args = parser.parse_args()
+
+    with db.Db() as db_conn:
+        db_conn.create_database(args.db_name)
+
+    with db.Db(db_name=args.db_name) as db_conn:
+        cursor = db_conn.session.cursor()
+        cursor.execute('DROP TABLE IF EXISTS events')
+        cursor.execute('DROP TABLE IF EXISTS schema_version')
+        db_conn.migrate(target=2)
+
+        started = time.time()
+        populate(db_conn, args.rows)
+        print('Inserted {} rows in {:.1f}s'.format(args.rows, time.time() - started))
+
+        before = measure(db_conn, args.repeat)
+        started = time.time()
+        version = db_conn.migrate()
+        print('Migrated to version {} in {:.1f}s'.format(version, time.time() - started))
+        after = measure(db_conn, args.repeat)
+
+    print('{:<24}{:>14}{:>14}'.format('query (median)', 'before ms', 'after ms'))
+    for name in before:
+        print('{:<24}{:>14.2f}{:>14.2f}'.format(name, before[name], after[name]))
+
+
+if __name__ == '__main__':
+    main()
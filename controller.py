@@ -2,144 +2,438 @@
 
 from utilities.settings import CONFIG
 from event_processor.processor import Processor
+from event_processor.steering import SteeringEngine
+from lib.rib import Rib
+from lib.attributes import InternTable, AttributeSet, LabelStack
+from lib.trie import PrefixTrie
+from lib.bestpath import BestPathSelector
+from lib import snapshot
+from lib.snapshot import RibSnapshot
+from lib.changeset import ChangeSet, HttpSink, LogSink
+from lib.route import LabeledRoute, encode_prefix, decode_prefix, ip_to_int, route_key
+from lib import ingest
+from lib.writer import CommandWriter
+from lib.notify import Listener
+from lib import metrics
 import functools
 import logging
 import sys
-import json
 import select
 import queue
+import time
 
 
 NLRI = CONFIG['NLRI']
 logger = logging.getLogger(__name__)
-logging.basicConfig(filename=CONFIG['LOGFILE'], filemode='w', level=logging.DEBUG)
+logging.basicConfig(filename=CONFIG['LOGFILE'], filemode='a', level=getattr(logging, CONFIG['LOG_LEVEL']))
+
+MESSAGES = metrics.REGISTRY.counter(
+    'epe_messages_total', 'ExaBGP messages handled, by type', ('type',))
+SKIPPED = metrics.REGISTRY.counter(
+    'epe_messages_skipped_total', 'ExaBGP lines not handled, by reason', ('reason',))
+PARSE_SECONDS = metrics.REGISTRY.histogram(
+    'epe_message_parse_seconds', 'Time decoding one ExaBGP message')
+HANDLE_SECONDS = metrics.REGISTRY.histogram(
+    'epe_message_handle_seconds', 'Time handling one decoded ExaBGP message, by type', ('type',))
+BATCH_LINES = metrics.REGISTRY.histogram(
+    'epe_stdin_batch_lines', 'Lines read from ExaBGP per wakeup',
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000))
 
 
 class Controller(object):
 
-    def __init__(self):
+    def __init__(self, classifier=None):
+        """
+        :param classifier:  a callable deciding from the raw line whether a message is
+                            decoded, defaults to ingest.MessageClassifier for CONFIG['NLRI']
+        """
+        self.classifier = classifier or ingest.MessageClassifier(NLRI)
+        self.writer = CommandWriter(sys.stdout.fileno())
         self.queue = queue.Queue()
-        self.processor = Processor(self.queue)
+        self.listener = None
+        if CONFIG['EVENT_SOCKET']:
+            self.listener = Listener(self.queue, CONFIG['EVENT_SOCKET'])
+            self.listener.start()
+        self._reset_rib()
+        self.snapshot = None
+        if CONFIG['SNAPSHOT_FILE']:
+            self.snapshot = RibSnapshot(CONFIG['SNAPSHOT_FILE'], CONFIG['SNAPSHOT_INTERVAL'])
+            try:
+                self.restore_snapshot()
+            except Exception:
+                # A damaged snapshot must not keep the controller from starting, the
+                # neighbors re-advertise the RIB anyway
+                logger.exception('Failed to restore {}, starting with an empty RIB'.format(
+                                 self.snapshot.path))
+                self.snapshot.discard()
+                self._reset_rib()
+
+        # Subscribed after the restore, downstream already holds the restored best paths
+        self.best_paths.subscribe(self.best_path_changed)
+        sink = HttpSink(CONFIG['CHANGESET_URL']) if CONFIG['CHANGESET_URL'] else LogSink()
+        self.changes = ChangeSet(sink, CONFIG['CHANGESET_WINDOW'], CONFIG['CHANGESET_MAX'])
+        self.best_paths.subscribe(self.changes.record)
+
+        metrics.REGISTRY.gauge('epe_rib_routes', 'Routes in the Adj-RIB-In of every neighbor',
+                               callback=lambda: len(self.rib))
+        metrics.REGISTRY.gauge('epe_rib_prefixes', 'Prefixes with a best path',
+                               callback=lambda: len(self.best_paths))
+        metrics.REGISTRY.gauge('epe_writer_backlog_bytes', 'Bytes queued for ExaBGP and not written yet',
+                               callback=lambda: self.writer.backlog()[1])
+        self.metrics_server = None
+        if CONFIG['METRICS_PORT']:
+            profiler = metrics.SamplingProfiler() if CONFIG['PROFILER'] else None
+            self.metrics_server = metrics.serve(CONFIG['METRICS_PORT'], profiler=profiler)
+
+        # Started last, the steering engine reads the restored RIB
+        self.processor = Processor(self.queue, steering=self.steering)
         self.processor.start()
 
 
-    def update_status(self, status):
-        self.labeled_unicast_routes = list()
+    def _reset_rib(self):
+        self.rib = Rib()
+        self.attribute_sets = InternTable(AttributeSet)
+        self.label_stacks = InternTable(LabelStack)
+        self.prefixes = PrefixTrie()
+        self.best_paths = BestPathSelector()
+        self.steering = SteeringEngine(self.prefixes, self.best_paths, self.writer,
+                                       CONFIG['EGRESS_INTERFACES'], CONFIG['STEERING_ATTRIBUTES'],
+                                       CONFIG['STEERING_HOLD'])
+
+
+    def update_status(self, peer, status):
+        """Flush only the routes of the neighbor whose session changed state.
+
+        With graceful restart the routes are marked stale on down instead, refreshed
+        in place as the neighbor re-learns them and swept on End-of-RIB or timer.
+        """
+
+        if status not in ("up", "down"):
+            return
+
+        if CONFIG['GRACEFUL_RESTART']:
+            if status == "down":
+                stale = self.rib.mark_stale(peer, time.time())
+                logger.info('Neighbor {} down, marked {} routes stale'.format(peer, stale))
+            return
+
+        partition = self.rib.get_partition(peer)
+        if status == "up" and partition is not None and partition.stale_count():
+            # Routes restored from a snapshot, reconciled against the re-learn instead
+            return
 
+        dropped = self.rib.flush(peer)
+        for route in dropped or ():
+            self._discard_route(route)
+        logger.info('Neighbor {} {}, flushed {} routes'.format(
+                    peer, status, len(dropped) if dropped else 0))
 
-    def _parse_aspath(self, aspath):
-        segments = list()
-        as_sequence = aspath.split()
-        segments.append({"as-sequence":as_sequence})
-        return segments 
 
+    def end_of_rib(self, peer, family):
+        """Sweep routes the neighbor did not refresh before End-of-RIB."""
 
-    def _parse_communities(self, communities):
-        community_list = []
-        for community in communities:
-            community_list.append({"semantics":community[0], "as-number":community[1]})
-        return community_list
+        if "{} {}".format(family.get("afi"), family.get("safi")) != NLRI:
+            return
+        self.sweep_stale(peer)
+
+
+    def sweep_stale(self, peer):
+        swept = self.rib.sweep(peer)
+        for route_key, route in swept:
+            self._discard_route(route)
+        if swept:
+            logger.info('Neighbor {} swept {} stale routes'.format(peer, len(swept)))
+        return swept
+
+
+    def expire_stale(self, now=None):
+        """Sweep neighbors whose stale routes outlived CONFIG['STALE_TIMER']."""
+
+        if now is None:
+            now = time.time()
+        for peer in self.rib.expired(now, CONFIG['STALE_TIMER']):
+            self.sweep_stale(peer)
 
 
     def _parse_attributes(self, attr):
-        attributes = dict()
-        attributes["origin"]= {"value":attr["origin"]}
-        attributes["multi-exit-desc"] = {"med":attr["med"]}
-        attributes["local-pref"] = {"pref":attr["local-preference"]}
-        attributes["as-path"] = self._parse_aspath(attr["as-path"]) if attr.get("as-path") else {}
-        attributes["communities"] = self._parse_communities(attr["community"]) if attr.get("community") else {}
-        attributes["originator-id"] = {"originator":attr["originator-id"]} if attr.get("originator-id") else {}
-        attributes["cluster-id"] = {"cluster":attr["cluster-list"]} if attr.get("cluster-list") else {}
-        return attributes
+        """Intern the attribute section of an update, taking one reference to it."""
+        return self.attribute_sets.intern(AttributeSet.make_key(attr))
 
 
     def _parse_labels(self, labels):
-        labelstack = list()
-        for label in labels["label"]:
-            labelstack.append({"label-value":label})
-        return labelstack
+        """Intern a label stack, taking one reference to it."""
+        return self.label_stacks.intern(LabelStack.make_key(labels))
+
+
+    def _release_route(self, route):
+        self.attribute_sets.release(route.attributes)
+        self.label_stacks.release(route.labels)
+
+
+    def _index_route(self, route, previous=None):
+        """Add a route to the paths of its prefix in the trie, replacing previous."""
+
+        paths = self.prefixes.get(route.address, route.length, ())
+        if previous is not None:
+            paths = tuple(path for path in paths if path is not previous)
+        paths += (route,)
+        self.prefixes.insert(route.address, route.length, paths)
+        self.best_paths.select(route.network, paths)
+        if previous is None:
+            self.steering.add(route)
+        else:
+            self.steering.update(previous, route)
+        if self.snapshot is not None:
+            self.snapshot.record(route.peer, route.key, route)
+
+
+    def _discard_route(self, route):
+        """Drop a route removed from the RIB from the trie and the intern tables."""
+
+        paths = tuple(path for path in self.prefixes.get(route.address, route.length, ())
+                      if path is not route)
+        if paths:
+            self.prefixes.insert(route.address, route.length, paths)
+        else:
+            self.prefixes.remove(route.address, route.length)
+        self.best_paths.select(route.network, paths)
+        self.steering.remove(route)
+        if self.snapshot is not None:
+            self.snapshot.record(route.peer, route.key, None)
+        self._release_route(route)
+
+
+    def restore_snapshot(self):
+        """Reload the RIB saved before a restart, marked stale until the neighbors re-learn it."""
+
+        started = time.time()
+        for operation, peer, address, length, nexthop, labels, attributes in self.snapshot.load():
+            peer = sys.intern(peer)
+            key = route_key((address << 6) | length, nexthop)
+            if operation == snapshot.WITHDRAW:
+                route = self.rib.withdraw(peer, key)
+            else:
+                route = self.rib.announce(peer, key, LabeledRoute(
+                    key, self.label_stacks.intern(labels), self.attribute_sets.intern(attributes), peer))
+            if route is not None:
+                self._release_route(route)
+
+        # Index each prefix once with all of its paths rather than route by route
+        prefixes = dict()
+        for route in self.rib:
+            prefixes.setdefault(route.network, []).append(route)
+        for network, paths in prefixes.items():
+            paths = tuple(paths)
+            self.prefixes.insert(network >> 6, network & 0x3f, paths)
+            self.best_paths.select(network, paths)
+            for route in paths:
+                self.steering.add(route)
+
+        now = time.time()
+        for peer in self.rib.peers():
+            self.rib.mark_stale(peer, now)
+        if len(self.rib):
+            logger.info('Restored {} routes from {} in {:.3f}s'.format(
+                        len(self.rib), self.snapshot.path, now - started))
+
+
+    def steer(self, prefix, nexthop, labels=(), attributes=''):
+        """Queue a steering route for ExaBGP to announce, see CommandWriter.announce()."""
+
+        self.writer.announce(prefix, nexthop, labels, attributes)
+
+
+    def unsteer(self, prefix):
+        """Queue the withdraw of a steering route."""
+
+        self.writer.withdraw(prefix)
+
+
+    def best_path_changed(self, network, old, new):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Best path for {} changed from {} to {}'.format(
+                         decode_prefix(network), old, new))
+
+
+    def best_path(self, prefix):
+        """The path selected for a prefix, or None."""
+
+        return self.best_paths.best(encode_prefix(prefix))
+
+
+    def lookup(self, address):
+        """Longest-prefix match, the paths of the most specific prefix covering an address."""
+
+        entry = self.prefixes.lookup(ip_to_int(address))
+        return list(entry[2]) if entry else []
+
+
+    def routes_for(self, prefix):
+        """Exact match, the paths learned for a prefix."""
+
+        network = encode_prefix(prefix)
+        return list(self.prefixes.get(network >> 6, network & 0x3f, ()))
+
+
+    def routes_under(self, prefix):
+        """Every path for a prefix and all the prefixes more specific than it."""
+
+        network = encode_prefix(prefix)
+        return [route
+                for address, length, paths in self.prefixes.subtree(network >> 6, network & 0x3f)
+                    for route in paths
+               ]
 
 
     @staticmethod
     def _route_key(prefix, nexthop):
-        return prefix + "_" + nexthop
+        return route_key(encode_prefix(prefix), ip_to_int(nexthop))
 
 
     @staticmethod
     def check_update_type(update_type):
         def wrapper(func):
             @functools.wraps(func)
-            def inner(message):
+            def inner(self, message, peer):
                 update_message = message[update_type][NLRI]
-                attributes = message['attribute']
-                return func(update_message, attributes)
+                attributes = message.get('attribute', {})
+                return func(self, update_message, attributes, peer)
             return inner
         return wrapper
 
 
     @check_update_type('announce')
-    def prefix_announced(self, bgp_update, attributes):
+    def prefix_announced(self, bgp_update, attributes, peer):
         """Parse BGP Update in JSON format received by ExaBGP and transform into ODL format."""
 
+        debug = logger.isEnabledFor(logging.DEBUG)
         parsed_attributes = self._parse_attributes(attributes)
         for nexthop in bgp_update:
-            parsed_attributes["ipv4-next-hop"] = {"global":nexthop}
+            packed_nexthop = ip_to_int(nexthop)
 
             for prefix in bgp_update[nexthop]:
-                route_key = self._route_key(prefix, nexthop)
-                label_stack = self._parse_labels(bgp_update[nexthop][prefix])
-                labeled_unicast_route = {
-                                         "route-key":route_key,
-                                         "prefix":prefix,
-                                         "attributes":parsed_attributes,
-                                         "label_stack":label_stack
-                                        }
-
-            self.labeled_unicast_routes.append(labeled_unicast_route)
-        logger.debug(self.labeled_unicast_routes)
+                labeled_unicast_route = LabeledRoute(
+                    route_key(encode_prefix(prefix), packed_nexthop),
+                    self._parse_labels(bgp_update[nexthop][prefix]),
+                    self.attribute_sets.retain(parsed_attributes),
+                    peer)
+                previous = self.rib.announce(peer, labeled_unicast_route.key, labeled_unicast_route)
+                self._index_route(labeled_unicast_route, previous)
+                if previous is None:
+                    if debug:
+                        logger.debug('Announced {} via {}'.format(prefix, nexthop))
+                    continue
+                self._release_route(previous)
+                if not debug:
+                    continue
+                if previous == labeled_unicast_route:
+                    logger.debug('Refreshed {} via {}'.format(prefix, nexthop))
+                else:
+                    logger.debug('Replaced {} via {}'.format(prefix, nexthop))
+        self.attribute_sets.release(parsed_attributes)
 
 
     @check_update_type('withdraw')
-    def prefix_withdrawn(self, bgp_update, attributes):
+    def prefix_withdrawn(self, bgp_update, attributes, peer):
         """Remove BGP-LU Prefixes withdrawn in BGP Update."""
 
+        debug = logger.isEnabledFor(logging.DEBUG)
         for nexthop in bgp_update:
             for prefix in bgp_update[nexthop]:
                 route_key = self._route_key(prefix, nexthop)
-                self.labeled_unicast_routes.remove( filter(lambda x: x["route-key"] == route_key,
-                                                           self.labeled_unicast_routes)[0]
-                                                  )
-        logger.debug(self.labeled_unicast_routes)
+                route = self.rib.withdraw(peer, route_key)
+                if route is not None:
+                    self._discard_route(route)
+                    if debug:
+                        logger.debug('Withdrawn {} via {}'.format(prefix, nexthop))
 
 
-    def process_update(self, bgp_update):
+    def process_update(self, bgp_update, peer):
         # Accept only BGP Labeled-Unicast updates
         if "announce" in bgp_update and NLRI in bgp_update["announce"]:
-            self.prefix_announced(bgp_update)
+            self.prefix_announced(bgp_update, peer)
 
         if "withdraw" in bgp_update and NLRI in bgp_update["withdraw"]:
-            self.prefix_withdrawn(bgp_update)
+            self.prefix_withdrawn(bgp_update, peer)
 
 
     def handle_message(self, message):
+        if message["type"] not in ("update", "state"):
+            return
+
+        peer = sys.intern(message["neighbor"]["address"]["peer"])
+
         if message["type"] == "update":
-            bgp_update = message["neighbor"]["message"]["update"]
-            self.process_update(bgp_update)
+            bgp_update = message["neighbor"]["message"].get("update", message["neighbor"]["message"])
+            if "eor" in bgp_update:
+                self.end_of_rib(peer, bgp_update["eor"])
+            else:
+                self.process_update(bgp_update, peer)
 
         if message["type"] == "state":
             status = message["neighbor"]["state"]
-            self.update_status(status)
+            self.update_status(peer, status)
+
+
+    def handle_messages(self, lines):
+        """Decode a batch of raw ExaBGP lines and handle them in order."""
+
+        BATCH_LINES.observe(len(lines))
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if not self.classifier(line):
+                SKIPPED.inc('filtered')
+                continue
+            started = time.perf_counter()
+            try:
+                message = ingest.loads(line)
+            except ValueError:
+                SKIPPED.inc('malformed')
+                logger.warning('Discarding malformed message: {!r}'.format(line[:200]))
+                continue
+            parsed = time.perf_counter()
+            self.handle_message(message)
+            PARSE_SECONDS.observe(parsed - started)
+            HANDLE_SECONDS.observe(time.perf_counter() - parsed, message["type"])
+            MESSAGES.inc(message["type"])
 
 
     def run(self):
-        inputs = [sys.stdin]
-
-        while True:
-            read_ready, write_ready, except_ready = select.select(inputs, [], [], 0.01)
-            for readable in read_ready:
-                if readable is sys.stdin:
-                    line = sys.stdin.readline().strip()
-                    message = json.loads(line)
-                    self.handle_message(message)
-
-
+        reader = ingest.LineReader(sys.stdin.fileno())
+        metrics.REGISTRY.gauge('epe_stdin_backlog_bytes', 'Bytes ExaBGP wrote that are not handled yet',
+                               callback=reader.backlog)
+
+        while not reader.eof:
+            now = time.time()
+            with self.steering.lock:
+                self.expire_stale(now)
+                self.steering.expire(now)
+            if self.changes.due(now):
+                self.changes.flush()
+            if self.snapshot is not None and self.snapshot.due(now):
+                self.snapshot.checkpoint(self.rib)
+
+            timeout = 1.0
+            if self.changes.deadline is not None:
+                timeout = max(0.0, min(timeout, self.changes.deadline - now))
+            writers = [self.writer] if self.writer.wants_write() else []
+            read_ready, write_ready, except_ready = select.select([reader], writers, [], timeout)
+            # The Processor's workers steer from the RIB and queue on the writer
+            with self.steering.lock:
+                if read_ready:
+                    self.handle_messages(reader.read_lines())
+                if self.writer.wants_write():
+                    self.writer.flush()
+
+        self.changes.close()
+        if self.snapshot is not None:
+            self.snapshot.checkpoint(self.rib)
+        if self.listener is not None:
+            self.listener.shutdown()
+        self.processor.shutdown()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+
+        logger.info('ExaBGP closed stdin, exiting')
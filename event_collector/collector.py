@@ -2,34 +2,39 @@
 
 import sys
 import time
-import queue
-import logger
-import threading
+import random
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from sdn.lib import db
+from sdn.lib.notify import Notifier
+from sdn.lib.dedup import EventCache
+from sdn.lib.timeseries import UtilizationStore
+from sdn.lib.classify import InterfaceClassifier
+from sdn.lib import metrics
 from sdn.utilities.settings import CONFIG
 from automation.tasks import get_interfaces_utilization
 
 
 logger = logging.getLogger(__name__)
 
+POLL_SECONDS = metrics.REGISTRY.histogram(
+    'epe_collector_poll_seconds', 'Time polling and analyzing one device, by device', ('device',))
+POLL_FAILURES = metrics.REGISTRY.counter(
+    'epe_collector_poll_failures_total', 'Polls that timed out, failed or were skipped, by reason',
+    ('device', 'reason'))
+EVENTS = metrics.REGISTRY.counter(
+    'epe_collector_events_total', 'Breaches found, by whether they created an event', ('outcome',))
 
-class Collector(threading.Thread):
-    """Collect device interface utilization and create events in DB"""
-
-    def __init__(self, work_queue):
-        super(Processor, self).__init__()
-        self.work_queue = work_queue
 
+class Collector(object):
+    """Collect device interface utilization and create events in DB"""
 
-    def run(self, device):
-        """Receive device-name using queue and run task"""
-
-        while True:
-            try:
-                device = self.work_queue.get()
-                self.process(device)
-            finally:
-                self.work_queue.task_done()
+    def __init__(self, notifier=None, cache=None, store=None, classifier=None):
+        self.notifier = notifier
+        self.cache = cache
+        self.store = store or UtilizationStore()
+        self.classifier = classifier or InterfaceClassifier(CONFIG['INTERFACE_ROLES'])
 
 
     def process(self, device):
@@ -37,54 +42,146 @@ class Collector(threading.Thread):
 
         device_response = get_interfaces_utilization(device)
         logger.debug('Response received from device {}:\n\t{}'.format(device, device_response))
-        result = self.analyze(device_response)
+        result = self.analyze(device, device_response)
     
         if result:
             logger.debug('Following interfaces have high utilization on {}: {}'.format(
-                          device, ', '.join(interface['name'] for interface in result)
+                          device, ', '.join(interface['name'] for interface in result)))
             self.create_event(device, result)
 
 
-    @staticmethod
-    def analyze(interfaces):
-        """Analyze output for high utilization on interesting interfaces"""
-
-        def find_interesting(intfs):
-            return [intf
-                    for intf in intfs
-                        if 'transit' in intf["description"].lower() or
-                           'peer' in intf['description'].lower()
-                   ]
-
+    def analyze(self, device, interfaces):
+        """Analyze output for sustained high utilization on interesting interfaces"""
 
-        THRESHOLD = 10.0
-        interesting_interfaces = find_interesting(interfaces)
+        interesting_interfaces = [interface
+                                  for interface, role in self.classifier.classify(device, interfaces)]
+        breached = self.store.update(device, [(interface['name'], interface['output_utilization'])
+                                              for interface in interesting_interfaces])
         return [interface
-                for interface in interesting_interfaces
-                    if item['output_utilization'] > THRESHOLD
-               ]  
-
-
-    def create_event(device, result):
-        pass
-
+                for interface, breach in zip(interesting_interfaces, breached)
+                    if breach
+               ]
+
+
+    def create_event(self, device, result):
+        """Store an event per interface without an open one and wake the processor"""
+
+        now = time.time()
+        events = [db.Event(now, device, interface['name']) for interface in result
+                  if self.cache is None or not self.cache.seen(device, interface['name'], now)]
+        EVENTS.inc('suppressed', amount=len(result) - len(events))
+        if not events:
+            logger.debug('Suppressed duplicate events on {}'.format(device))
+            return
+        with db.Db() as db_conn:
+            db_conn.insert_events(events)
+        EVENTS.inc('created', amount=len(events))
+        if self.cache is not None:
+            for event in events:
+                self.cache.add(event)
+        if self.notifier is not None:
+            self.notifier.notify()
+
+
+
+class Scheduler(object):
+    """Poll every device on its own schedule from one asyncio loop.
+
+    The blocking device calls run on a thread pool, at most concurrency of them at
+    once, and are abandoned after timeout seconds so a slow device only delays its own
+    next poll.  A device whose abandoned call is still running is skipped until it
+    returns, so each device holds at most one thread outside the concurrency slots and
+    the pool is sized for that: hung calls never take the threads other polls need.
+    """
+
+    def __init__(self, collector, schedules, concurrency=16, timeout=30):
+        """
+        :param collector:       the Collector polling a device with process()
+        :param schedules:       a dict of device name to (interval, jitter) seconds
+        :param concurrency:     the number of devices polled at once at most
+        :param timeout:         the seconds a poll may take
+        """
+        self.collector = collector
+        self.schedules = schedules
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # A thread per slot plus one per device for a call abandoned on timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency + len(schedules),
+                                           thread_name_prefix='collector')
+
+
+    async def poll(self, device, interval, jitter, semaphore):
+        """Poll a device every interval seconds, delayed by up to jitter seconds"""
+
+        loop = asyncio.get_running_loop()
+        pending = None
+        # Spread the first polls over an interval instead of hitting every device at once
+        scheduled = loop.time() + random.uniform(0, interval)
+        while True:
+            await asyncio.sleep(max(0.0, scheduled + random.uniform(0, jitter) - loop.time()))
+            scheduled = max(scheduled + interval, loop.time())
+
+            if pending is not None and not pending.done():
+                logger.warning('Skipping {}, its previous poll is still running'.format(device))
+                POLL_FAILURES.inc(device, 'skipped')
+                continue
+            async with semaphore:
+                started = loop.time()
+                pending = loop.run_in_executor(self.executor, self.collector.process, device)
+                # Unlike wait_for, wait leaves the call running on timeout
+                done, _ = await asyncio.wait({pending}, timeout=self.timeout)
+            if not done:
+                logger.warning('Polling {} timed out after {}s'.format(device, self.timeout))
+                POLL_FAILURES.inc(device, 'timeout')
+            elif pending.exception() is not None:
+                logger.error('Failed to poll {}'.format(device), exc_info=pending.exception())
+                POLL_FAILURES.inc(device, 'error')
+            else:
+                logger.debug('Polled {} in {:.2f}s'.format(device, loop.time() - started))
+                POLL_SECONDS.observe(loop.time() - started, device)
+
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.gather(*(self.poll(device, interval, jitter, semaphore)
+                                   for device, (interval, jitter) in self.schedules.items()))
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def get_schedules(config=CONFIG):
+    """Build each device's (interval, jitter) from the defaults and DEVICE_SCHEDULES"""
+
+    schedules = {}
+    for device in config['DEVICES']:
+        overrides = config['DEVICE_SCHEDULES'].get(device, {})
+        schedules[device] = (overrides.get('interval', config['POLL_INTERVAL']),
+                             overrides.get('jitter', config['POLL_JITTER']))
+    return schedules
 
 
 def main():
 
-    devices = CONFIG['DEVICES']
-
-    work_queue = queue.Queue()
-    for i in range(len(devices)):
-        t = Collector(work_queue)
-        t.daemon = True
-        t.start()
-
-    while True:
-        for device in devices:
-            work_queue.put(device)
-        work_queue.join()
-        time.sleep(60)
+    if CONFIG['COLLECTOR_METRICS_PORT']:
+        metrics.serve(CONFIG['COLLECTOR_METRICS_PORT'],
+                      profiler=metrics.SamplingProfiler() if CONFIG['PROFILER'] else None)
+    notifier = Notifier(address=CONFIG['EVENT_SOCKET'])
+    cache = EventCache(CONFIG['DEDUP_TTL'], CONFIG['DEDUP_SIZE'])
+    try:
+        with db.Db() as db_conn:
+            for status in ('QUEUED', 'ACTIVE'):
+                cache.warm(db_conn.get_events_by_status(db.Event.STATUS_CODES[status],
+                                                        limit=cache.size))
+    except Exception:
+        # The cache only suppresses duplicates, polling goes on without its warm-up
+        logger.exception('Failed to warm the event cache, starting with an empty one')
+
+    store = UtilizationStore(CONFIG['UTILIZATION_THRESHOLD'], CONFIG['BREACH_WINDOW'],
+                             CONFIG['BREACH_SAMPLES'], CONFIG['EWMA_ALPHA'], CONFIG['SURGE_RATE'])
+    scheduler = Scheduler(Collector(notifier, cache, store), get_schedules(),
+                          CONFIG['POLL_CONCURRENCY'], CONFIG['POLL_TIMEOUT'])
+    asyncio.run(scheduler.run())
 
 
 if __name__ == "__main__":
@@ -4,59 +4,188 @@ import threading
 import logging
 import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 from sdn.lib import db
+from sdn.lib import notify
+from sdn.lib import metrics
 
 
 logger = logging.getLogger(__name__)
 
+CLAIM_SECONDS = metrics.REGISTRY.histogram(
+    'epe_processor_claim_seconds', 'Time claiming a batch of events')
+BATCH_EVENTS = metrics.REGISTRY.histogram(
+    'epe_processor_batch_events', 'Events claimed per batch', buckets=(0, 1, 2, 4, 8, 16, 32, 64))
+PROCESS_SECONDS = metrics.REGISTRY.histogram(
+    'epe_processor_process_seconds', 'Time processing one event')
+EVENTS = metrics.REGISTRY.counter(
+    'epe_processor_events_total', 'Events processed, by result', ('result',))
+
 
 class Processor(threading.Thread):
     """Receive events from DB and process them."""
 
-    EVENT_RATE = 1
-
-    def __init__(self, event_queue):
+    WORKERS = 4
+    MIN_BATCH = 1
+    MAX_BATCH = 64
+    POLL_INTERVAL = 5.0
+    LEASE_CHECK_INTERVAL = 60
+    MAX_MIGRATE_BACKOFF = 60.0
+
+    def __init__(self, event_queue=None, workers=WORKERS, poll_interval=POLL_INTERVAL,
+                 steering=None):
+        """
+        :param event_queue:     the queue.Queue producers signal new events on, see
+                                lib.notify.Notifier
+        :param steering:        the steering.SteeringEngine congestion events are handed to
+        :param workers:         the number of threads process_event() runs on
+        :param poll_interval:   the seconds between two claims while no signal arrives
+        """
         super(Processor, self).__init__()
-        self.event_queue = event_queue
-        self.shutting_down = threading.Event() 
-        self.event_rate = Processor.EVENT_RATE
+        self.event_queue = event_queue if event_queue is not None else queue.Queue()
+        self.shutting_down = threading.Event()
+        self.workers = workers
+        self.event_rate = Processor.MIN_BATCH
+        self.poll_interval = poll_interval
+        self.steering = steering
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='processor')
+        self.lease_checked = 0
 
 
     def process_event(self, event):
-        pass
+        """Steers traffic off the congested interface of an event.
+
+        SUCCESS once no affected prefix is left on the interface, FAILURE if some had
+        no alternate path, UNKNOWN if the interface is not a known egress interface.
+        """
+
+        if self.steering is None:
+            return db.Event.RESULT_CODES['UNKNOWN']
+        counts = self.steering.congested(event.device, event.interface)
+        if counts is None:
+            return db.Event.RESULT_CODES['UNKNOWN']
+        affected, stranded = counts
+        if stranded:
+            return db.Event.RESULT_CODES['FAILURE']
+        return db.Event.RESULT_CODES['SUCCESS']
+
+
+    def _process(self, event):
+        """Runs process_event() on a worker thread and maps its outcome to a result code."""
+
+        started = time.perf_counter()
+        try:
+            result = self.process_event(event)
+        except Exception:
+            logger.exception('Failed to process {}'.format(event))
+            result = db.Event.RESULT_CODES['EXCEPTION']
+        if result not in db.Event.RESULT_CODES.values():
+            result = db.Event.RESULT_CODES['UNKNOWN']
+        PROCESS_SECONDS.observe(time.perf_counter() - started)
+        EVENTS.inc(db.Event.RESULT_NAMES[result])
+        return event, result
 
 
     @staticmethod
-    def save_result(result):
-        pass
+    def save_result(results):
+        """Records the results of a batch and marks its events PROCESSED.
+
+        :param results:     a list of (event, result code) tuples
+        """
+
+        if not results:
+            return
+        by_result = dict()
+        for event, result in results:
+            by_result.setdefault(result, []).append(event.event_id)
+
+        with db.Db() as db_conn:
+            for result, event_ids in by_result.items():
+                db_conn.update_results(event_ids, result)
+            db_conn.update_statuses([event.event_id for event, result in results],
+                                    db.Event.STATUS_CODES['PROCESSED'])
+
+
+    def _adapt(self, claimed):
+        """Doubles the batch size while batches come back full, halves it as the queue drains."""
+
+        if claimed >= self.event_rate:
+            self.event_rate = min(self.event_rate * 2, Processor.MAX_BATCH)
+        elif claimed < self.event_rate // 2:
+            self.event_rate = max(self.event_rate // 2, Processor.MIN_BATCH)
+
+
+    def _idle(self):
+        """Sleeps until a producer signals new events, or the poll interval elapses."""
+
+        try:
+            self.event_queue.get(timeout=self.poll_interval)
+        except queue.Empty:
+            return
+        notify.drain(self.event_queue)
 
 
     def event_handler(self):
         """Locates new events to work on and processes them."""
 
         while not self.shutting_down.is_set():
-            with db.Db() as db_conn:
+            try:
+                with db.Db() as db_conn, CLAIM_SECONDS.time():
+                    now = time.time()
+                    if now - self.lease_checked >= Processor.LEASE_CHECK_INTERVAL:
+                        db_conn.requeue_expired()
+                        self.lease_checked = now
+
+                    events = db_conn.claim_events(limit=self.event_rate)
+            except Exception:
+                logger.exception('Failed to claim events')
+                self._idle()
+                continue
+
+            BATCH_EVENTS.observe(len(events))
+            self._adapt(len(events))
+            if not events:
+                self._idle()
+                continue
 
-                status = db.Event.STATUS_CODES['QUEUED']
-                events = db_conn.get_events_by_status(
-                    status, limit=self.event_rate)
-                if not events:
-                    logger.info('No events to process')
-                    time.sleep(2)
-                    continue
+            futures = [self.executor.submit(self._process, event) for event in events]
+            self.save_result([future.result() for future in futures])
 
-            for event in events:
-                result = self.process_event(event)
+
+    def migrate(self):
+        """Brings the schema up to date, retrying with back-off while the DB is
+        unreachable or another process holds the migration lock.
+
+        :returns migrated:  False if shut down before the migration succeeded
+        """
+
+        delay = 1.0
+        while not self.shutting_down.is_set():
+            try:
+                with db.Db() as db_conn:
+                    db_conn.migrate()
+                return True
+            except Exception:
+                logger.exception('Failed to migrate the event database, retrying in {:.0f}s'.format(delay))
+            self.shutting_down.wait(delay)
+            delay = min(delay * 2, Processor.MAX_MIGRATE_BACKOFF)
+        return False
 
 
     def run(self):
-        self.event_handler()
+        try:
+            if self.migrate():
+                self.event_handler()
+        finally:
+            self.executor.shutdown(wait=True)
 
 
-    def shutdown(self):
-        """Gracefully terminate threads."""
+    def shutdown(self, timeout=None):
+        """Gracefully terminate threads, letting the batch in flight finish and be saved."""
 
         logger.debug('Terminating process: {}'.format(
             threading.current_thread().getName()))
         self.shutting_down.set()
- 
+        self.event_queue.put_nowait(notify.NEW_EVENTS)
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import threading
+from sdn.lib.bestpath import preference
+from sdn.lib.route import decode_prefix, ip_to_int
+
+
+logger = logging.getLogger(__name__)
+
+
+class SteeringEngine(object):
+    """Moves prefixes off congested egress interfaces onto alternate labeled paths.
+
+    The engine keeps an index from each next-hop to the prefixes with a path through
+    it, updated by the controller as routes come and go.  A congested (device,
+    interface) maps to the egress peer next-hops behind it through the configured
+    egress table, and from there straight to the affected prefixes, so handling an
+    event never scans the RIB.  Each affected prefix whose best path uses an avoided
+    next-hop is announced through ExaBGP via its best path that does not.
+
+    Congestion is held for hold seconds after the last event for an interface, a
+    breach that persists raising a new event before then, after which expire()
+    returns its prefixes to their normal paths.
+
+    The controller's thread changes routes while the Processor's workers steer, so
+    both hold lock, the controller around each batch of messages and writer flush.
+    """
+
+    def __init__(self, prefixes, best_paths, writer, egress, attributes='', hold=900):
+        """
+        :param prefixes:    the controller's lib.trie.PrefixTrie of paths per prefix
+        :param best_paths:  the controller's lib.bestpath.BestPathSelector
+        :param writer:      the lib.writer.CommandWriter steering routes are queued on
+        :param egress:      a dict of device to a dict of interface to the list of
+                            egress peer next-hops reached through it
+        :param attributes:  the ExaBGP attributes steering routes are announced with,
+                            e.g. "local-preference 200" to win over the originals
+        :param hold:        the seconds an interface stays congested after its last event
+        """
+        self.prefixes = prefixes
+        self.best_paths = best_paths
+        self.writer = writer
+        self.attributes = attributes
+        self.hold = hold
+        self.egress = {(device, interface): frozenset(ip_to_int(nexthop) for nexthop in nexthops)
+                       for device, interfaces in egress.items()
+                       for interface, nexthops in interfaces.items()}
+        self.lock = threading.RLock()
+        self._networks = dict()
+        self._congested = dict()
+        self._avoided = frozenset()
+        self._steered = dict()
+
+
+    def add(self, route):
+        """ Indexes a new path, re-steering its prefix if it is affected. """
+        networks = self._networks.setdefault(route.nexthop, dict())
+        networks[route.network] = networks.get(route.network, 0) + 1
+        if self._affects(route):
+            self._steer(route.network)
+
+
+    def update(self, previous, route):
+        """ Re-steers the prefix of a path replaced under the same key, its labels or
+            attributes may have changed.
+        """
+        if self._affects(route):
+            self._steer(route.network)
+
+
+    def remove(self, route):
+        """ Unindexes a path the RIB dropped, re-steering its prefix if it is affected. """
+        networks = self._networks.get(route.nexthop)
+        if networks is not None:
+            count = networks.get(route.network, 0) - 1
+            if count > 0:
+                networks[route.network] = count
+            else:
+                networks.pop(route.network, None)
+                if not networks:
+                    del self._networks[route.nexthop]
+        if self._affects(route):
+            self._steer(route.network)
+
+
+    def _affects(self, route):
+        """ Whether a path changing can change the steering of its prefix. """
+        if not self._avoided and not self._steered:
+            return False
+        if route.network in self._steered or route.nexthop in self._avoided:
+            return True
+        # A new path may be the first alternate of a prefix stranded on a congested one
+        best = self.best_paths.best(route.network)
+        return best is not None and best.nexthop in self._avoided
+
+
+    def _affected(self, nexthops):
+        networks = set()
+        for nexthop in nexthops:
+            networks.update(self._networks.get(nexthop, ()))
+        return networks
+
+
+    def _steer(self, network):
+        """ Announces the best path of a prefix avoiding the congested next-hops, or
+            withdraws its steering route once the prefix no longer needs one.
+
+            :returns stranded:  whether the best path of the prefix still uses a
+                                congested next-hop, there being no alternate
+        """
+        prefix = decode_prefix(network)
+        best = self.best_paths.best(network)
+        congested = best is not None and best.nexthop in self._avoided
+        alternate = None
+        if congested:
+            paths = [path for path in self.prefixes.get(network >> 6, network & 0x3f, ())
+                     if path.nexthop not in self._avoided]
+            if paths:
+                alternate = min(paths, key=preference)
+
+        if alternate is None:
+            if self._steered.pop(network, None) is not None:
+                self.writer.withdraw(prefix)
+                logger.info('Stopped steering {}'.format(prefix))
+            return congested
+
+        # The key only holds the prefix and next-hop, a re-announce may change the rest
+        steered = (alternate.key, alternate.labels.key, alternate.attributes.key)
+        if self._steered.get(network) != steered:
+            self._steered[network] = steered
+            self.writer.announce(prefix, alternate.nexthop_address, alternate.labels.key,
+                                 self.attributes)
+            logger.info('Steering {} via {} labels {}'.format(
+                        prefix, alternate.nexthop_address, list(alternate.labels.key)))
+        return False
+
+
+    def _update_avoided(self):
+        self._avoided = frozenset().union(*(nexthops for nexthops, expires
+                                            in self._congested.values()))
+
+
+    def congested(self, device, interface, now=None):
+        """ Steers the prefixes reached through a congested interface onto alternates.
+
+            :returns counts:    (affected prefixes, prefixes left without an alternate),
+                                or None when the interface is not an egress interface
+        """
+        nexthops = self.egress.get((device, interface))
+        if nexthops is None:
+            logger.warning('No egress next-hops known for {} {}'.format(device, interface))
+            return None
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._congested[(device, interface)] = (nexthops, now + self.hold)
+            self._update_avoided()
+            affected = self._affected(nexthops)
+            stranded = sum(1 for network in affected if self._steer(network))
+        logger.info('{} {} congested: {} prefixes affected, {} without an alternate'.format(
+                    device, interface, len(affected), stranded))
+        return len(affected), stranded
+
+
+    def cleared(self, device, interface):
+        """ Returns the prefixes steered away from an interface to their normal paths. """
+        with self.lock:
+            entry = self._congested.pop((device, interface), None)
+            if entry is None:
+                return 0
+            self._update_avoided()
+            affected = self._affected(entry[0])
+            for network in affected:
+                self._steer(network)
+        return len(affected)
+
+
+    def expire(self, now=None):
+        """ Clears the interfaces whose congestion was not refreshed within hold. """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            expired = [interface for interface, (nexthops, expires) in self._congested.items()
+                       if expires <= now]
+        for device, interface in expired:
+            count = self.cleared(device, interface)
+            logger.info('{} {} congestion expired, {} prefixes back on their normal paths'.format(
+                        device, interface, count))
+        return len(expired)
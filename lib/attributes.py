@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class InternTable(object):
+    """Hash-consing table handing out one shared, reference counted entry per value.
+
+    Routes with identical path attributes or label stacks point to the same entry, so
+    comparing them is an identity check.  An entry is dropped from the table once the
+    last reference to it is released.
+    """
+
+    def __init__(self, factory):
+        """
+        :param factory:     a callable building a new entry from its hashable key
+        """
+        self.factory = factory
+        self._entries = dict()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+
+    def intern(self, key):
+        """ Gets the shared entry for a key and takes a reference to it. """
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = self.factory(key)
+        entry.refcount += 1
+        return entry
+
+
+    @staticmethod
+    def retain(entry):
+        """ Takes an additional reference to an entry already interned. """
+        entry.refcount += 1
+        return entry
+
+
+    def release(self, entry):
+        """ Drops a reference, removing the entry when nothing points to it anymore. """
+        entry.refcount -= 1
+        if entry.refcount <= 0:
+            del self._entries[entry.key]
+
+
+class AttributeSet(object):
+    """Immutable BGP path attributes shared by every route that carries them."""
+
+    __slots__ = ('key', 'refcount')
+
+    ORIGINS = {'igp': 0, 'egp': 1, 'incomplete': 2}
+
+    def __init__(self, key):
+        self.key = key
+        self.refcount = 0
+
+
+    @staticmethod
+    def make_key(attr):
+        """ Builds the canonical hashable form of the ExaBGP "attribute" section. """
+        aspath = attr.get("as-path") or ()
+        if isinstance(aspath, str):
+            aspath = aspath.strip("[] ").split()
+        return (
+            attr.get("origin"),
+            attr.get("med"),
+            attr.get("local-preference"),
+            tuple(str(asn) for asn in aspath),
+            tuple(tuple(community) for community in attr.get("community") or ()),
+            attr.get("originator-id"),
+            tuple(attr.get("cluster-list") or ()),
+        )
+
+
+    origin = property(lambda self: self.key[0])
+    med = property(lambda self: self.key[1])
+    local_pref = property(lambda self: self.key[2])
+    as_path = property(lambda self: self.key[3])
+    communities = property(lambda self: self.key[4])
+    originator_id = property(lambda self: self.key[5])
+    cluster_list = property(lambda self: self.key[6])
+
+
+    def to_odl(self):
+        """ Renders the attributes in ODL format as a new dict. """
+        attributes = dict()
+        attributes["origin"] = {"value":self.origin}
+        attributes["multi-exit-desc"] = {"med":self.med}
+        attributes["local-pref"] = {"pref":self.local_pref}
+        attributes["as-path"] = [{"as-sequence":list(self.as_path)}] if self.as_path else {}
+        attributes["communities"] = [{"semantics":community[0], "as-number":community[1]}
+                                     for community in self.communities] if self.communities else {}
+        attributes["originator-id"] = {"originator":self.originator_id} if self.originator_id else {}
+        attributes["cluster-id"] = {"cluster":list(self.cluster_list)} if self.cluster_list else {}
+        return attributes
+
+
+    def __repr__(self):
+        return 'AttributeSet({!r})'.format(self.key)
+
+
+class LabelStack(object):
+    """Immutable MPLS label stack shared by every route that carries it."""
+
+    __slots__ = ('key', 'refcount')
+
+    def __init__(self, key):
+        self.key = key
+        self.refcount = 0
+
+
+    @staticmethod
+    def make_key(labels):
+        """ Builds the canonical hashable form of an ExaBGP {"label": [...]} entry. """
+        return tuple(labels["label"])
+
+
+    def to_odl(self):
+        return [{"label-value":label} for label in self.key]
+
+
+    def __repr__(self):
+        return 'LabelStack({!r})'.format(self.key)
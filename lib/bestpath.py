@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import logging
+import functools
+import ipaddress
+from .attributes import AttributeSet
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_PREF = 100
+
+
+@functools.lru_cache(maxsize=4096)
+def address_key(address):
+    """ Orders IPv4 and IPv6 neighbor addresses alike, IPv4 first, and anything that
+        is not an address after them by its text.
+    """
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return (7, address.encode())
+    return (address.version, address.packed)
+
+
+def preference(route):
+    """ Ranks a path for best-path selection, the lowest value wins.
+
+        Local-pref, AS-path length, origin, MED, originator-id (or the neighbor
+        address when the path was not reflected), cluster-list length and finally
+        the neighbor address and next-hop.  MED is always compared, whichever
+        AS the paths came from.
+    """
+    attributes = route.attributes
+    local_pref = attributes.local_pref
+    peer = address_key(route.peer)
+    return (
+        -(DEFAULT_LOCAL_PREF if local_pref is None else local_pref),
+        len(attributes.as_path),
+        AttributeSet.ORIGINS.get(attributes.origin, 2),
+        attributes.med or 0,
+        address_key(attributes.originator_id) if attributes.originator_id else peer,
+        len(attributes.cluster_list),
+        peer,
+        route.nexthop,
+    )
+
+
+class BestPathSelector(object):
+    """Per-prefix best-path selection, recomputed only for the prefix that changed.
+
+    Callbacks registered with subscribe() are called as callback(network, old, new)
+    whenever the best path of a prefix changes, old or new being None when the
+    prefix appears or disappears.
+    """
+
+    def __init__(self):
+        self._best = dict()
+        self._subscribers = list()
+
+
+    def __len__(self):
+        return len(self._best)
+
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+
+    def best(self, network):
+        """ Gets the best path of a prefix packed by route.encode_prefix(), or None. """
+        return self._best.get(network)
+
+
+    def select(self, network, paths):
+        """ Re-runs selection for one prefix after its paths changed.
+
+            :param network:     the prefix packed by route.encode_prefix()
+            :param paths:       every path currently known for the prefix
+            :returns route:     the best path, or None if there are no paths left
+        """
+        old = self._best.get(network)
+        if not paths:
+            new = None
+            self._best.pop(network, None)
+        else:
+            new = paths[0] if len(paths) == 1 else min(paths, key=preference)
+            self._best[network] = new
+
+        # A refresh with identical content is not a change
+        if old is None and new is None or old is not None and old == new:
+            return new
+
+        for callback in self._subscribers:
+            try:
+                callback(network, old, new)
+            except Exception:
+                logger.exception('Best-path subscriber {} failed'.format(callback))
+        return new
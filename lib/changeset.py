@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+import json
+import time
+import queue
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """A change-set the consumer refused, sending it again cannot succeed."""
+
+
+class LogSink(object):
+    """Sink that only logs the size of each change-set, used when no consumer is configured."""
+
+    def send(self, payload):
+        logger.info('Change-set: {} announced, {} withdrawn'.format(
+                    len(payload["announce"]), len(payload["withdraw"])))
+
+
+class HttpSink(object):
+    """Posts change-sets as JSON over a pool of keep-alive HTTP connections."""
+
+    def __init__(self, url, pool_size=2, timeout=5.0):
+        """
+        :param url:         the http:// or https:// URL the change-sets are posted to
+        :param pool_size:   the number of idle connections kept open
+        :param timeout:     the socket timeout in seconds
+        """
+        parts = urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parts.netloc
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, timeout=self.timeout)
+
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+    def send(self, payload):
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        # A pooled connection may have been closed by the server, retry once on a fresh one
+        for attempt in range(2):
+            connection = self._acquire()
+            try:
+                connection.request('POST', self.path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            if response.status >= 500:
+                raise IOError('Change-set failed with HTTP {} {}'.format(
+                              response.status, response.reason))
+            if response.status >= 300:
+                raise Rejected('Change-set rejected with HTTP {} {}'.format(
+                               response.status, response.reason))
+            return
+
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ChangeSet(object):
+    """Collects route changes over a window and pushes their net effect in one batch.
+
+    Only the route each key had when the window opened and the one it has now are
+    kept, so a flap inside the window collapses to nothing and repeated updates to
+    the last one.
+
+    Payloads are sent from a background thread, through a hand-off holding one of
+    them, so a slow or failing sink never blocks the caller.  The sender retries a
+    failed payload with exponential back-off; meanwhile new changes keep collapsing
+    into the next one.  A payload the sink raises Rejected for is dropped instead.
+    """
+
+    def __init__(self, sink, window=0.5, max_changes=10000, max_backoff=30.0):
+        """
+        :param sink:        an object with a send(payload) method
+        :param window:      the seconds changes are held before they are flushed
+        :param max_changes: the number of pending keys that triggers an early flush
+        :param max_backoff: the most seconds between two attempts to send a payload
+        """
+        self.sink = sink
+        self.window = window
+        self.max_changes = max_changes
+        self.max_backoff = max_backoff
+        self.deadline = None
+        self._origin = dict()
+        self._current = dict()
+        self._handoff = queue.Queue(maxsize=1)
+        self._closed = threading.Event()
+        self._sender = threading.Thread(target=self._send_loop, name='changeset', daemon=True)
+        self._sender.start()
+
+
+    def __len__(self):
+        return len(self._current)
+
+
+    def record(self, key, old, new):
+        """ Records that key changed from route old to route new, either being None. """
+        if key not in self._origin:
+            self._origin[key] = old
+            if self.deadline is None:
+                self.deadline = time.time() + self.window
+        self._current[key] = new
+
+
+    def due(self, now=None):
+        if self.deadline is None:
+            return False
+        if len(self._current) >= self.max_changes:
+            return True
+        return (now or time.time()) >= self.deadline
+
+
+    def payload(self):
+        """ Builds the net announce/withdraw payload of the pending changes. """
+        announce = list()
+        withdraw = list()
+        for key, new in self._current.items():
+            old = self._origin[key]
+            if old is None and new is None or old is not None and old == new:
+                continue
+            if old is not None and (new is None or old.key != new.key):
+                withdraw.append(old.odl_key)
+            if new is not None:
+                announce.append(new.to_odl())
+        return {"announce": announce, "withdraw": withdraw}
+
+
+    def flush(self):
+        """ Hands the pending changes to the sender, keeping them for the next flush
+            while it is still busy with earlier ones.
+
+            :returns count:     the number of routes announced or withdrawn downstream
+        """
+        if self.deadline is None:
+            return 0
+        if self._handoff.full():
+            self.deadline = time.time() + self.window
+            return 0
+        payload = self.payload()
+        count = len(payload["announce"]) + len(payload["withdraw"])
+        if count:
+            # Only this thread puts, the slot checked above is still free
+            self._handoff.put_nowait(payload)
+        self._origin = dict()
+        self._current = dict()
+        self.deadline = None
+        return count
+
+
+    def _send_loop(self):
+        while True:
+            payload = self._handoff.get()
+            if payload is None:
+                return
+            delay = self.window
+            while True:
+                try:
+                    self.sink.send(payload)
+                    break
+                except Rejected:
+                    logger.exception('Dropped a change-set of {} routes the consumer rejected'.format(
+                                     len(payload["announce"]) + len(payload["withdraw"])))
+                    break
+                except Exception:
+                    logger.exception('Failed to push change-set, retrying in {:.1f}s'.format(delay))
+                if self._closed.wait(delay):
+                    logger.error('Dropped a change-set of {} routes on shutdown'.format(
+                                 len(payload["announce"]) + len(payload["withdraw"])))
+                    break
+                delay = min(delay * 2, self.max_backoff)
+            # Not held while waiting for the next one, it may be large
+            del payload
+
+
+    def close(self, timeout=5.0):
+        """ Hands off the pending changes and waits up to timeout seconds for them to
+            be sent, after which the sender stops retrying.
+        """
+        deadline = time.time() + timeout
+        while self.deadline is not None and time.time() < deadline:
+            if not self.flush():
+                time.sleep(0.05)
+        try:
+            self._handoff.put(None, timeout=max(0.0, deadline - time.time()))
+        except queue.Full:
+            pass
+        self._sender.join(max(0.0, deadline - time.time()))
+        self._closed.set()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import re
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class InterfaceClassifier(object):
+    """Assigns interfaces a role from their description, remembered per device.
+
+    The role of each interface is cached with the description it was derived from,
+    so a poll only compares descriptions and matches the patterns again for the
+    interfaces whose description changed.
+    """
+
+    def __init__(self, roles):
+        """
+        :param roles:   a dict of role to regular expression searched for in the
+                        description, case-insensitively, tried in order
+        """
+        self.patterns = [(role, re.compile(pattern, re.IGNORECASE))
+                         for role, pattern in roles.items()]
+        self._devices = dict()
+        self._lock = threading.Lock()
+
+
+    def match(self, description):
+        """ Gets the role of a description, None if it has none. """
+        for role, pattern in self.patterns:
+            if pattern.search(description):
+                return role
+        return None
+
+
+    def classify(self, device, interfaces):
+        """ Keeps the interfaces of a device that have a role.
+
+            :param interfaces:  a list of dicts with "name" and "description" keys
+            :returns pairs:     a list of (interface, role) tuples
+        """
+        interesting = []
+        # Held throughout, roles() may copy the cache of this device meanwhile
+        with self._lock:
+            cache = self._devices.setdefault(device, dict())
+            for interface in interfaces:
+                name, description = interface['name'], interface['description']
+                cached = cache.get(name)
+                if cached is None or cached[0] != description:
+                    role = self.match(description)
+                    cache[name] = (description, role)
+                    if cached is not None:
+                        logger.debug('{} {} reclassified as {}'.format(device, name, role))
+                else:
+                    role = cached[1]
+                if role is not None:
+                    interesting.append((interface, role))
+
+            if len(cache) > len(interfaces):
+                names = set(interface['name'] for interface in interfaces)
+                for name in [name for name in cache if name not in names]:
+                    del cache[name]
+        return interesting
+
+
+    def roles(self, device):
+        """ Gets the interfaces of a device with a role, as a dict of name to role. """
+        with self._lock:
+            cache = dict(self._devices.get(device, ()))
+        return {name: role for name, (description, role) in cache.items() if role is not None}
+
+
+    def forget(self, device):
+        with self._lock:
+            self._devices.pop(device, None)
@@ -1,8 +1,19 @@
 #!/usr/bin/env python
 
-import mysql.connector
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+import sqlite3
+import fcntl
+import collections
+import threading
+import socket
+import os
 import traceback
 import logging
+import time
+from . import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -12,6 +23,26 @@ DB_NAME = 'sdn'
 DB_USER = 'root'
 DB_PASS = 'root'
 
+# 'mysql' or 'sqlite', the embedded database stored at DB_PATH
+DB_BACKEND = 'mysql'
+DB_PATH = '/home/amit/Code/sdn/log/events.db'
+
+BATCH_SIZE = 1000
+
+CLAIM_LEASE = 300
+
+POOL_SIZE = 8
+POOL_TIMEOUT = 10
+POOL_IDLE_TIMEOUT = 300
+POOL_CHECK_AFTER = 30
+
+# Seconds a process waits for another one to finish migrating, schema changes on a
+# large events table can take much longer than a query
+MIGRATE_LOCK_TIMEOUT = 3600
+
+QUERY_SECONDS = metrics.REGISTRY.histogram(
+    'epe_db_query_seconds', 'Time spent in Db methods, by method', ('method',))
+
 SCHEMA = ('''
     CREATE TABLE IF NOT EXISTS events (
         id              BIGINT(64) NOT NULL AUTO_INCREMENT,
@@ -23,6 +54,63 @@ SCHEMA = ('''
         PRIMARY KEY (id)) ENGINE=InnoDB AUTO_INCREMENT=1
 ''')
 
+SCHEMA_VERSION = ('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version         INT NOT NULL,
+        description     VARCHAR(255) NOT NULL,
+        applied_at      BIGINT(64) NOT NULL,
+        PRIMARY KEY (version)) ENGINE=InnoDB
+''')
+
+# (version, description, statements), applied in order by Db.migrate()
+MIGRATIONS = [
+    (1, 'Create events table', [SCHEMA]),
+    (2, 'Track event claims', ['''
+        ALTER TABLE events
+            ADD COLUMN claimed_by VARCHAR(128) NULL,
+            ADD COLUMN claimed_at BIGINT(64) NULL
+    ''']),
+    (3, 'Index event queue and duplicate lookups', [
+        # get_events_by_status() and claim_events(): status filter in id order
+        'CREATE INDEX events_status_id ON events (status, id)',
+        # get_event_id(): covering, the primary key is part of every InnoDB index
+        'CREATE INDEX events_lookup ON events (device, interface, status, result)',
+        # requeue_expired()
+        'CREATE INDEX events_claims ON events (status, claimed_at)',
+    ]),
+]
+
+SQLITE_SCHEMA = ('''
+    CREATE TABLE IF NOT EXISTS events (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp       BIGINT NOT NULL,
+        device          VARCHAR(128) NOT NULL,
+        interface       VARCHAR(128) NOT NULL,
+        status          SMALLINT NOT NULL DEFAULT 0,
+        result          SMALLINT NOT NULL DEFAULT 0)
+''')
+
+SQLITE_SCHEMA_VERSION = ('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version         INTEGER NOT NULL PRIMARY KEY,
+        description     VARCHAR(255) NOT NULL,
+        applied_at      BIGINT NOT NULL)
+''')
+
+# The same versions as MIGRATIONS in SQLite's dialect
+SQLITE_MIGRATIONS = [
+    (1, 'Create events table', [SQLITE_SCHEMA]),
+    (2, 'Track event claims', [
+        'ALTER TABLE events ADD COLUMN claimed_by VARCHAR(128) NULL',
+        'ALTER TABLE events ADD COLUMN claimed_at BIGINT NULL',
+    ]),
+    (3, 'Index event queue and duplicate lookups', [
+        'CREATE INDEX events_status_id ON events (status, id)',
+        'CREATE INDEX events_lookup ON events (device, interface, status, result)',
+        'CREATE INDEX events_claims ON events (status, claimed_at)',
+    ]),
+]
+
 
 class Event:
     """ Represents data for an event or fault that is stored into a database and
@@ -48,7 +136,8 @@ class Event:
     RESULT_NAMES = _reverse_dict(RESULT_CODES)
 
 
-    def __init__(self, timestamp, device, interface, status=None, result=None, event_id=0): 
+    def __init__(self, timestamp, device, interface, status=None, result=None, event_id=0,
+                 claimed_by=None, claimed_at=None):
         """ 
         :param timestamp:       a datetime formatted string
         :param device:          a device name
@@ -60,6 +149,8 @@ class Event:
                                 represents the status of this event
                                 after attempting remediation
         :param event_id:        an auto-incrementing id for new events
+        :param claimed_by:      the worker that moved the event to ACTIVE
+        :param claimed_at:      when the worker claimed the event
         """
         self._validate_params(status, result)
         self.timestamp = int(timestamp)
@@ -72,6 +163,8 @@ class Event:
             result = self.RESULT_CODES['UNKNOWN']
         self.result = result
         self.event_id = event_id
+        self.claimed_by = claimed_by
+        self.claimed_at = claimed_at
 
 
     def _validate_params(self, status, result):
@@ -91,24 +184,380 @@ class Event:
         if self.event_id:
             event_details = (
                 'event_id={}, {}'.format(self.event_id, event_details))
+        if self.claimed_by:
+            event_details = (
+                '{}, claimed_by={}, claimed_at={}'.format(
+                event_details, self.claimed_by, self.claimed_at))
         return event_details
 
 
-class Db(object):
-    """ Manages database interactions for connectivity to a MySQL-based backend
+class PoolTimeout(Exception):
+    """ Raised when no pooled connection frees up in time. """
+
+
+class ConnectionPool(object):
+    """ Thread-safe pool of database connections shared by every Db instance that
+        connects with the same credentials.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 idle_timeout=POOL_IDLE_TIMEOUT, check_after=POOL_CHECK_AFTER, ping=None):
+        """
+        :param connect:         a callable opening a new connection
+        :param size:            the maximum number of open connections
+        :param timeout:         the seconds acquire() waits for a free connection
+        :param idle_timeout:    the seconds an idle connection is kept open
+        :param check_after:     the seconds of idleness after which a connection is
+                                pinged before being handed out again
+        :param ping:            a callable checking a connection is still usable,
+                                defaults to mysql-connector's is_connected()
+        """
+        self._connect = connect
+        self._ping = ping or (lambda connection: connection.is_connected())
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self._idle = collections.deque()
+        self._open = 0
+        self._condition = threading.Condition()
+
+
+    def __str__(self):
+        return 'ConnectionPool:  open={}, idle={}, size={}'.format(
+            self._open, len(self._idle), self.size)
+
+
+    def _evict(self, now):
+        """ Closes connections idle for longer than idle_timeout, oldest first. """
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            connection, last_used = self._idle.popleft()
+            self._open -= 1
+            self._close(connection)
+
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.debug('Failed to close pooled connection:\n{}'.format(traceback.format_exc()))
+
+
+    def _healthy(self, connection, last_used):
+        if time.time() - last_used < self.check_after:
+            return True
+        try:
+            return self._ping(connection)
+        except Exception:
+            return False
+
+
+    def acquire(self):
+        """ Hands out an idle connection, or opens a new one while under size. """
+        deadline = time.time() + self.timeout
+        while True:
+            with self._condition:
+                self._evict(time.time())
+                while not self._idle and self._open >= self.size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout('No DB connection available after {}s, {}'.format(
+                                          self.timeout, self))
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                else:
+                    connection, last_used = None, None
+                    self._open += 1
+
+            if connection is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discarded()
+                    raise
+            if self._healthy(connection, last_used):
+                return connection
+            logger.debug('Dropping stale pooled DB connection')
+            self._close(connection)
+            self._discarded()
+
+
+    def release(self, connection):
+        """ Returns a connection to the pool. """
+        with self._condition:
+            self._idle.append((connection, time.time()))
+            self._condition.notify()
+
+
+    def discard(self, connection):
+        """ Closes a connection that must not be reused, e.g. after an error. """
+        self._close(connection)
+        self._discarded()
+
+
+    def _discarded(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+
+    def close(self):
+        """ Closes every idle connection. """
+        with self._condition:
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                self._open -= 1
+                self._close(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def default_worker_id():
+    """ Identifies the calling thread across hosts, e.g. "host:1234:Thread-1". """
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.current_thread().name)
+
+
+class MysqlBackend(object):
+    """ Dialect and connection details of a MySQL server, through mysql-connector. """
+
+    name = 'mysql'
+    schema_version = SCHEMA_VERSION
+    migrations = MIGRATIONS
+    # claim_events() locks the rows it selects, skipping the ones other workers hold
+    claim_lock = 'FOR UPDATE SKIP LOCKED'
 
     def __init__(self, db_user=DB_USER, db_pass=DB_PASS, db_host=DB_HOST, db_name=DB_NAME):
+        if mysql is None:
+            raise ImportError('mysql-connector is required for the MySQL backend')
+        self.db_user = db_user
+        self.db_pass = db_pass
+        self.db_host = db_host
+        self.db_name = db_name
+        self.key = (self.name, db_user, db_host, db_name)
+        self.errors = (mysql.connector.Error,)
+
+
+    def __str__(self):
+        return 'backend={}, db_host={}, db_name={}'.format(self.name, self.db_host, self.db_name)
+
+
+    def connect(self):
+        return mysql.connector.connect(
+            user=self.db_user, password=self.db_pass, host=self.db_host, database=self.db_name)
+
+
+    @staticmethod
+    def ping(connection):
+        return connection.is_connected()
+
+
+    @staticmethod
+    def translate(sql):
+        return sql
+
+
+    @staticmethod
+    def create_database(cursor, db_name):
+        cursor.execute('CREATE DATABASE IF NOT EXISTS {}'.format(db_name))
+
+
+    @staticmethod
+    def lock(cursor, name, timeout):
+        """ Takes a server-wide named lock, returning a handle for unlock() or None. """
+        cursor.execute('SELECT GET_LOCK(%s, %s)', (name, timeout))
+        return name if cursor.fetchone()[0] else None
+
+
+    @staticmethod
+    def unlock(cursor, handle):
+        cursor.execute('SELECT RELEASE_LOCK(%s)', (handle,))
+        cursor.fetchall()
+
+
+    @staticmethod
+    def begin(session):
+        """ Nothing to do, the locking SELECT opens the transaction. """
+
+
+    @staticmethod
+    def insert_rows(cursor, rows):
+        """ Inserts event rows with one multi-row INSERT per batch.
+
+            Ids are derived from the first id of each statement, which relies on
+            InnoDB handing consecutive AUTO_INCREMENT values to a multi-row insert
+            (auto_increment_increment=1, innodb_autoinc_lock_mode 0 or 1).
+        """
+        event_ids = []
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            sql = ('''
+                INSERT INTO events (
+                    timestamp, device, interface, status, result)
+                VALUES {}
+            '''.format(', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))))
+            cursor.execute(sql, [param for row in batch for param in row])
+            first_id = cursor.lastrowid
+            event_ids.extend(range(first_id, first_id + len(batch)))
+        return event_ids
+
+
+class SqliteBackend(object):
+    """ Dialect and connection details of an embedded SQLite database file.
+
+        The database runs in WAL mode, so readers do not block the writer.  Every
+        write transaction takes the write lock when it begins (BEGIN IMMEDIATE), which
+        is what makes claim_events() atomic without row locks.  Statements are reused
+        from each connection's prepared statement cache, keyed by their SQL text.
+    """
+
+    name = 'sqlite'
+    schema_version = SQLITE_SCHEMA_VERSION
+    migrations = SQLITE_MIGRATIONS
+    claim_lock = ''
+    errors = (sqlite3.Error,)
+    STATEMENT_CACHE = 256
+
+    def __init__(self, path=DB_PATH, busy_timeout=POOL_TIMEOUT):
+        """
+        :param path:            the database file, created when missing
+        :param busy_timeout:    the seconds a statement waits for another writer
+        """
+        self.path = path
+        self.db_name = os.path.splitext(os.path.basename(path))[0]
+        self.busy_timeout = busy_timeout
+        self.key = (self.name, os.path.abspath(path))
+        self._translated = {}
+
+
+    def __str__(self):
+        return 'backend={}, path={}'.format(self.name, self.path)
+
+
+    def connect(self):
+        connection = sqlite3.connect(
+            self.path, timeout=self.busy_timeout, isolation_level='IMMEDIATE',
+            check_same_thread=False, cached_statements=self.STATEMENT_CACHE)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # Durable across crashes of the process, WAL mode only loses the last
+        # transactions on power loss
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+
+    @staticmethod
+    def ping(connection):
+        connection.execute('SELECT 1').fetchone()
+        return True
+
+
+    def translate(self, sql):
+        """ Rewrites %s placeholders to SQLite's ?, memoized per statement. """
+        translated = self._translated.get(sql)
+        if translated is None:
+            translated = self._translated[sql] = sql.replace('%s', '?')
+        return translated
+
+
+    @staticmethod
+    def create_database(cursor, db_name):
+        """ Nothing to do, connect() creates the database file. """
+
+
+    def lock(self, cursor, name, timeout):
+        """ Takes an exclusive lock on a file next to the database, returning the
+            open lock file for unlock() or None.
+        """
+        lock_file = open('{}.{}.lock'.format(self.path, name), 'w')
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    lock_file.close()
+                    return None
+                time.sleep(0.05)
+
+
+    @staticmethod
+    def unlock(cursor, handle):
+        handle.close()
+
+
+    @staticmethod
+    def begin(session):
+        """ Takes the write lock before the SELECT of a read-then-update transaction. """
+        if not session.in_transaction:
+            session.execute('BEGIN IMMEDIATE')
+
+
+    @staticmethod
+    def insert_rows(cursor, rows):
+        """ Inserts event rows with one prepared INSERT executed per row.
+
+            The transaction holds the write lock, so AUTOINCREMENT hands out
+            consecutive ids ending at last_insert_rowid().
+        """
+        if not rows:
+            return []
+        cursor.executemany('''
+            INSERT INTO events (
+                timestamp, device, interface, status, result)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        cursor.execute('SELECT last_insert_rowid()')
+        last_id = cursor.fetchone()[0]
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def get_backend(db_user=DB_USER, db_pass=DB_PASS, db_host=DB_HOST, db_name=DB_NAME):
+    """ Builds the backend DB_BACKEND selects, SQLite ignoring the credentials. """
+    if DB_BACKEND == 'sqlite':
+        return SqliteBackend(DB_PATH)
+    return MysqlBackend(db_user, db_pass, db_host, db_name)
+
+
+def get_pool(backend, **kwargs):
+    """ Gets the process-wide pool for a backend's database, creating it on first use.
+
+        :param backend:     a MysqlBackend or SqliteBackend
+        :param kwargs:      ConnectionPool options, only used when the pool is created
+    """
+    with _pools_lock:
+        pool = _pools.get(backend.key)
+        if pool is None:
+            pool = _pools[backend.key] = ConnectionPool(backend.connect, ping=backend.ping, **kwargs)
+        return pool
+
+
+class Db(object):
+    """ Manages database interactions with a MySQL server or an embedded SQLite file.
+        Connections are borrowed from a ConnectionPool shared across the process.
+    """
+
+    def __init__(self, db_user=DB_USER, db_pass=DB_PASS, db_host=DB_HOST, db_name=DB_NAME,
+                 pool=None, backend=None):
         """
         :param db_user:     database username
         :param db_pass:     database password
         :param db_host:     an IP address or dns name
         :param db_name:     database name
+        :param pool:        a ConnectionPool, defaults to the shared one for the backend
+        :param backend:     a MysqlBackend or SqliteBackend, defaults to the one
+                            DB_BACKEND selects for these credentials
         """
     
         self.db_user = db_user
         self.db_pass = db_pass
         self.db_host = db_host
         self.db_name = db_name
+        self.backend = backend or get_backend(db_user, db_pass, db_host, db_name)
+        self.pool = pool or get_pool(self.backend)
         self.session = None
 
 
@@ -122,31 +571,49 @@ class Db(object):
 
     def __exit__(self, ex_type, ex_value, traceback):
         """ Handles automatic closing of a connection to the database backend.
+            A connection that raised a database error is not handed out again.
         """
-        self.close_session()
+        self.close_session(discard=ex_type is not None and issubclass(ex_type, self.backend.errors))
 
 
     def __str__(self):
-        return (
-            'Db:  db_host={}, db_name={}'.format(self.db_host, self.db_name))
+        return 'Db:  {}'.format(self.backend)
+
+
+    def _execute(self, cursor, sql, params=()):
+        """ Runs a statement written with %s placeholders in the backend's dialect. """
+        cursor.execute(self.backend.translate(sql), params)
 
 
     def open_session(self):
-        """ Opens a database connection and saves that connection object onto self.session."""
+        """ Borrows a database connection from the pool and saves it onto self.session."""
         if not self.session:
-            self.session = mysql.connector.connect(
-                user=self.db_user, password=self.db_pass,
-                host=self.db_host, database=self.db_name)
+            self.session = self.pool.acquire()
             if self.session:
                 logger.debug('Connected to DB {}'.format(self.db_name))
             else:
                 logger.debug('Failed to connect to DB {}'.format(self.db_name))
 
 
-    def close_session(self):
-        """ Gracefully terminates a connection to the database backend. """
-        self.session.close()
-        logger.debug('DB connection closed')
+    def close_session(self, discard=False):
+        """ Hands the connection back to the pool, rolling back anything uncommitted.
+
+            :param discard:     close the connection instead of reusing it
+        """
+        if not self.session:
+            return
+        session, self.session = self.session, None
+        if not discard and session.in_transaction:
+            try:
+                session.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self.pool.discard(session)
+            logger.debug('DB connection closed')
+        else:
+            self.pool.release(session)
+            logger.debug('DB connection returned to pool')
 
 
     def create_database(self, db_name=None):
@@ -155,9 +622,8 @@ class Db(object):
         """
         if not db_name:
             db_name = self.db_name
-        sql = 'CREATE DATABASE IF NOT EXISTS {}'.format(db_name)
         cursor = self.session.cursor()
-        cursor.execute(sql)
+        self.backend.create_database(cursor, db_name)
         self.session.commit()
         logger.debug('Database {} created'.format(db_name))
 
@@ -168,30 +634,89 @@ class Db(object):
         cursor.execute(schema)
 
 
+    @metrics.timed(QUERY_SECONDS)
+    def schema_version(self):
+        """ Gets the version of the last migration applied, 0 for a new database. """
+        cursor = self.session.cursor()
+        cursor.execute(self.backend.schema_version)
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        version = cursor.fetchone()[0]
+        self.session.commit()
+        return version
+
+
+    @metrics.timed(QUERY_SECONDS)
+    def migrate(self, target=None, migrations=None):
+        """ Applies the pending schema migrations in order.  A named lock keeps
+            processes starting together from migrating the same database twice.
+
+            :param target:      the version to stop at, defaults to the latest
+            :param migrations:  defaults to the backend's, MIGRATIONS on MySQL
+            :returns version:   the version the schema is at afterwards
+        """
+        migrations = migrations or self.backend.migrations
+        cursor = self.session.cursor()
+        lock = self.backend.lock(cursor, '{}.migrate'.format(self.db_name), MIGRATE_LOCK_TIMEOUT)
+        if lock is None:
+            raise Exception('Timed out waiting for another process to migrate {}'.format(self))
+        try:
+            version = self.schema_version()
+            for number, description, statements in migrations:
+                if number <= version or target is not None and number > target:
+                    continue
+                logger.info('Applying schema migration {}: {}'.format(number, description))
+                for statement in statements:
+                    cursor.execute(statement)
+                self._execute(
+                    cursor,
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)',
+                    (number, description, int(time.time())))
+                self.session.commit()
+                version = number
+            return version
+        finally:
+            self.backend.unlock(cursor, lock)
+
+
     def insert_event(self, event):
         """ Creates a new event based on the parameters provided.
 
             :param event:         an Event object
             :returns event_id:    the unique database id for the event
         """
-        params = (event.timestamp, event.device, event.interface, event.status, event.result)
-        if not all(params):
-            raise Exception(
-                'Unable to save event - one or more required values were '
-                'missing from:  {}'.format(event))
-        sql = ('''
-            INSERT INTO events (
-                timestamp, device, interface, status, result)
-            VALUES (
-                %s, %s, %s, %s, %s, %s)
-        ''')
+        return self.insert_events([event])[0]
+
+
+    @metrics.timed(QUERY_SECONDS)
+    def insert_events(self, events):
+        """ Creates many events in batched INSERTs and a single commit.
+
+            :param events:        a list of Event objects, their event_id is set
+            :returns event_ids:   the unique database ids, in the order of events
+        """
+        rows = []
+        for event in events:
+            params = (event.timestamp, event.device, event.interface, event.status, event.result)
+            if not all(params):
+                raise Exception(
+                    'Unable to save event - one or more required values were '
+                    'missing from:  {}'.format(event))
+            rows.append(params)
+
         cursor = self.session.cursor()
-        cursor.execute(sql, params)
-        event_id = cursor.lastrowid
-        self.session.commit()
-        return event_id
+        try:
+            event_ids = self.backend.insert_rows(cursor, rows)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+        for event, event_id in zip(events, event_ids):
+            event.event_id = event_id
+        return event_ids
 
 
+    @metrics.timed(QUERY_SECONDS)
     def get_event(self, event_id):
         """ Gets an event by its unique id."""
         sql = ('''
@@ -199,13 +724,14 @@ class Db(object):
             FROM events
             WHERE id=%s
         ''')
-        cursor = self.session.cursor(named_tuple=True)
-        cursor.execute(sql, (int(event_id),))
+        cursor = self.session.cursor()
+        self._execute(cursor, sql, (int(event_id),))
         row = cursor.fetchone()  # Returns a tuple
         event = Event(*row)
         return event
 
 
+    @metrics.timed(QUERY_SECONDS)
     def get_event_id(self, event):
         """ Gets an event by it's attributes.  This is primarily used to check
             for duplicates prior to creating a new entry with insert_event().
@@ -215,27 +741,30 @@ class Db(object):
             SELECT id
             FROM events
             WHERE (
-                device="%s" AND interface="%s" AND status=%s AND result=%s)
+                device=%s AND interface=%s AND status=%s AND result=%s)
+            LIMIT 1
         ''')
         cursor = self.session.cursor()
-        cursor.execute(sql, params)
+        self._execute(cursor, sql, params)
         row = cursor.fetchone()  # Returns a tuple
         if row:
             return row[0]
         return 0
 
 
+    @metrics.timed(QUERY_SECONDS)
     def get_events_by_status(self, status, limit=1000):
         """ Gets events by status up to the limit specified. """
         sql = ('''
             SELECT timestamp, device, interface, status, result, id
             FROM events
             WHERE status = %s
+            ORDER BY id
             LIMIT %s
         ''')
-        cursor = self.session.cursor(named_tuple=True)
-        cursor.execute(sql, (status, limit))
-        rows = cursor.fetchall()  # Returns a list of named tuples
+        cursor = self.session.cursor()
+        self._execute(cursor, sql, (status, limit))
+        rows = cursor.fetchall()  # Returns a list of tuples
 
         events = []
         for row in rows:
@@ -244,21 +773,88 @@ class Db(object):
         return events
 
 
-    def update_status(self, event_id, status):
-        """ Updates an event's status.
+    @metrics.timed(QUERY_SECONDS)
+    def claim_events(self, worker=None, limit=BATCH_SIZE):
+        """ Atomically moves a batch of QUEUED events to ACTIVE for one worker.
 
-            :param event_id:    a unique event ID
-            :param status:      a value of Event.STATUS_CODES
-            :returns None:
+            On MySQL the rows are locked with SKIP LOCKED, so concurrent workers
+            claim disjoint batches instead of waiting on each other.  On SQLite the
+            transaction holds the database's write lock instead.
+
+            :param worker:      an identifier of the claiming worker, defaults to
+                                default_worker_id()
+            :param limit:       the maximum number of events to claim
+            :returns events:    the claimed Event objects, oldest first
+        """
+        worker = worker or default_worker_id()
+        claimed_at = int(time.time())
+        sql = ('''
+            SELECT timestamp, device, interface, status, result, id
+            FROM events
+            WHERE status = %s
+            ORDER BY id
+            LIMIT %s
+            {}
+        '''.format(self.backend.claim_lock))
+        cursor = self.session.cursor()
+        try:
+            self.backend.begin(self.session)
+            self._execute(cursor, sql, (Event.STATUS_CODES['QUEUED'], limit))
+            rows = cursor.fetchall()
+            if rows:
+                sql = ('''
+                    UPDATE events
+                    SET status=%s, claimed_by=%s, claimed_at=%s
+                    WHERE id IN ({})
+                '''.format(', '.join(['%s'] * len(rows))))
+                self._execute(cursor, sql, [Event.STATUS_CODES['ACTIVE'], worker, claimed_at] +
+                              [row[5] for row in rows])
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+        events = []
+        for row in rows:
+            event = Event(*row)
+            event.status = Event.STATUS_CODES['ACTIVE']
+            event.claimed_by = worker
+            event.claimed_at = claimed_at
+            events.append(event)
+        return events
+
+
+    @metrics.timed(QUERY_SECONDS)
+    def requeue_expired(self, lease=CLAIM_LEASE):
+        """ Returns ACTIVE events whose claim is older than the lease to QUEUED, so
+            events held by a crashed worker get processed by another one.
+
+            :param lease:       the seconds a claim stays valid
+            :returns count:     the number of events requeued
         """
         sql = ('''
             UPDATE events
-            SET status=%s
-            WHERE id=%s
+            SET status=%s, claimed_by=NULL, claimed_at=NULL
+            WHERE status=%s AND claimed_at < %s
         ''')
         cursor = self.session.cursor()
-        cursor.execute(sql, (status, event_id))
+        self._execute(cursor, sql, (Event.STATUS_CODES['QUEUED'], Event.STATUS_CODES['ACTIVE'],
+                                    int(time.time() - lease)))
+        count = cursor.rowcount
         self.session.commit()
+        if count:
+            logger.info('Requeued {} events with expired claims'.format(count))
+        return count
+
+
+    def update_status(self, event_id, status):
+        """ Updates an event's status.
+
+            :param event_id:    a unique event ID
+            :param status:      a value of Event.STATUS_CODES
+            :returns None:
+        """
+        self.update_statuses([event_id], status)
 
 
     def update_result(self, event_id, result):
@@ -268,14 +864,45 @@ class Db(object):
             :param status:      a value of Event.RESULT_CODES
             :returns None:
         """
-        sql = ('''
-            UPDATE events
-            SET result=%s
-            WHERE id=%s
-        ''')
+        self.update_results([event_id], result)
+
+
+    @metrics.timed(QUERY_SECONDS)
+    def update_statuses(self, event_ids, status):
+        """ Sets the same status on many events with a single commit.
+
+            :param event_ids:   a list of unique event IDs
+            :param status:      a value of Event.STATUS_CODES
+            :returns count:     the number of rows changed
+        """
+        return self._update_column('status', event_ids, status)
+
+
+    @metrics.timed(QUERY_SECONDS)
+    def update_results(self, event_ids, result):
+        """ Sets the same result on many events with a single commit.
+
+            :param event_ids:   a list of unique event IDs
+            :param result:      a value of Event.RESULT_CODES
+            :returns count:     the number of rows changed
+        """
+        return self._update_column('result', event_ids, result)
+
+
+    def _update_column(self, column, event_ids, value):
+        count = 0
         cursor = self.session.cursor()
-        cursor.execute(sql, (result, event_id))
+        for start in range(0, len(event_ids), BATCH_SIZE):
+            batch = [int(event_id) for event_id in event_ids[start:start + BATCH_SIZE]]
+            sql = ('''
+                UPDATE events
+                SET {}=%s
+                WHERE id IN ({})
+            '''.format(column, ', '.join(['%s'] * len(batch))))
+            self._execute(cursor, sql, [value] + batch)
+            count += cursor.rowcount
         self.session.commit()
+        return count
 
 
 if __name__ == '__main__':
@@ -294,7 +921,7 @@ if __name__ == '__main__':
 
         # Build the tables
         try:
-            db.create_schema()
+            db.migrate()
         except Exception:
             print('Failed to create schema')
             raise
@@ -306,8 +933,7 @@ if __name__ == '__main__':
             timestamp=time.time(),
             status=Event.STATUS_CODES['QUEUED'],
             device='rtr01.example.com',
-            error_code='IF_DOWN',
-            error_message='Interface Ethernet1/1 is Down',
+            interface='Ethernet1/1',
             result=Event.RESULT_CODES['UNKNOWN'])
         try:
             event_id = db.insert_event(event)
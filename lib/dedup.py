@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventCache(object):
+    """Remembers the open event of each (device, interface) to suppress duplicates.
+
+    A breach of an interface with an event created less than ttl seconds ago is
+    dropped instead of queuing the same work for the Processor again; once the entry
+    expires the next breach creates a new event, which re-checks the interface.  The
+    cache holds at most size entries, evicting the least recently seen.  It is shared
+    by the collector threads.
+    """
+
+    def __init__(self, ttl=300, size=10000):
+        """
+        :param ttl:     the seconds an event suppresses new ones for its interface
+        :param size:    the number of interfaces remembered at most
+        """
+        self.ttl = ttl
+        self.size = size
+        self.suppressed = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def warm(self, events):
+        """ Loads open events from the DB, e.g. the QUEUED and ACTIVE ones at startup. """
+        for event in sorted(events, key=lambda event: event.timestamp):
+            self.add(event)
+        logger.info('Warmed event cache with {} open events'.format(len(self._entries)))
+
+
+    def add(self, event):
+        """ Records an event just created, suppressing its interface until it expires. """
+        key = (event.device, event.interface)
+        with self._lock:
+            self._entries[key] = (event.event_id, event.timestamp + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+    def seen(self, device, interface, now=None):
+        """ Checks whether the interface already has an open event.
+
+            :returns event_id:  the id of the open event, or 0 if a new one is needed
+        """
+        key = (device, interface)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return 0
+            event_id, expires = entry
+            if (now or time.time()) >= expires:
+                del self._entries[key]
+                return 0
+            self._entries.move_to_end(key)
+            self.suppressed += 1
+            return event_id
+
+
+    def discard(self, device, interface):
+        with self._lock:
+            self._entries.pop((device, interface), None)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import os
+import re
+import array
+import fcntl
+import termios
+import logging
+
+try:
+    import orjson as _json
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        import json as _json
+
+
+logger = logging.getLogger(__name__)
+
+# Fastest JSON decoder available, all of them accept bytes and raise ValueError
+loads = _json.loads
+
+
+class LineReader(object):
+    """Drains a non-blocking file descriptor in large chunks and splits it into lines."""
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, fd, chunk_size=CHUNK_SIZE):
+        """
+        :param fd:          a readable file descriptor, e.g. sys.stdin.fileno()
+        :param chunk_size:  the number of bytes requested per read() syscall
+        """
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.eof = False
+        self._partial = b''
+        os.set_blocking(fd, False)
+
+
+    def fileno(self):
+        return self.fd
+
+
+    def backlog(self):
+        """ The number of bytes written to the descriptor and not consumed as lines yet. """
+        pending = array.array('i', [0])
+        fcntl.ioctl(self.fd, termios.FIONREAD, pending)
+        return pending[0] + len(self._partial)
+
+
+    def read_lines(self):
+        """ Reads everything available without blocking.
+
+            :returns lines:     a list of complete lines as bytes, without the newline.
+                                Once EOF is reached a trailing partial line is returned
+                                too and self.eof is set.
+        """
+        chunks = [self._partial]
+        while True:
+            try:
+                chunk = os.read(self.fd, self.chunk_size)
+            except BlockingIOError:
+                break
+            if not chunk:
+                self.eof = True
+                break
+            chunks.append(chunk)
+
+        lines = b''.join(chunks).split(b'\n')
+        self._partial = lines.pop()
+        if self.eof and self._partial:
+            lines.append(self._partial)
+            self._partial = b''
+        return lines
+
+
+class MessageClassifier(object):
+    """Cheap accept/drop decision on a raw ExaBGP JSON line, taken before full decoding.
+
+    Any callable taking the raw line and returning a bool can be used in its place.
+    """
+
+    TYPE_PATTERN = re.compile(br'"type"\s*:\s*"([a-z-]+)"')
+
+    def __init__(self, nlri, types=("update", "state")):
+        """
+        :param nlri:        the ExaBGP family name updates must carry, e.g. CONFIG['NLRI']
+        :param types:       the message types to keep
+        """
+        self.types = frozenset(t.encode() for t in types)
+        self.family = '"{}"'.format(nlri).encode()
+        self.accepted = 0
+        self.dropped = 0
+
+
+    def __call__(self, raw):
+        match = self.TYPE_PATTERN.search(raw)
+        keep = match is not None and match.group(1) in self.types
+        if keep and match.group(1) == b"update":
+            keep = self.family in raw or b'"eor"' in raw
+        if keep:
+            self.accepted += 1
+        else:
+            self.dropped += 1
+        return keep
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import bisect
+import logging
+import threading
+import functools
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from 50us up to 10s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                            .replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in pairs) + '}'
+
+
+class Metric(object):
+    """Base of the metric types, a family of values keyed by label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonic count, e.g. of messages handled."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super(Counter, self).__init__(name, help, labels)
+        self._values = collections.defaultdict(float)
+
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, key), value)
+                for key, value in values]
+
+
+class Gauge(Metric):
+    """Current value, either set or read from a callback when scraped."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None):
+        """
+        :param callback:    a callable returning the value, for unlabeled gauges
+        """
+        super(Gauge, self).__init__(name, help, labels)
+        self.callback = callback
+        self._values = dict()
+
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                return ['{} {}'.format(self.name, self.callback())]
+            except Exception:
+                logger.exception('Failed to read gauge {}'.format(self.name))
+                return []
+        with self._lock:
+            values = list(self._values.items())
+        return ['{}{} {}'.format(self.name, _format_labels(self.labels, key), value)
+                for key, value in values]
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets, e.g. of latencies in seconds."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values to [count per bucket..., count above the last bucket, sum]
+        self._values = dict()
+
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+
+    def time(self, *labels):
+        """ A context manager observing the seconds its block takes. """
+        return _Timer(self, labels)
+
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                             self.name, _format_labels(self.labels, key, [('le', bound)]),
+                             cumulative))
+            labels = _format_labels(self.labels, key)
+            lines.append('{}_sum{} {}'.format(self.name, labels, counts[-1]))
+            lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class _Timer(object):
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, ex_type, ex_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def timed(histogram):
+    """ Decorates a method to observe its duration, labeled with the method's name. """
+    def decorator(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, func.__name__)
+        return inner
+    return decorator
+
+
+class Registry(object):
+    """The metrics exposed by a process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def register(self, metric):
+        """ Adds a metric, returning the one already registered under its name if any. """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+
+    def gauge(self, name, help, labels=(), callback=None):
+        gauge = self.register(Gauge(name, help, labels))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def _shared_registry():
+    """ This package is imported both as "lib" and as "sdn.lib", so the second copy of
+        this module reuses the registry the first one created.
+    """
+    for name in ('lib.metrics', 'sdn.lib.metrics'):
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, 'REGISTRY'):
+            return module.REGISTRY
+    return Registry()
+
+
+REGISTRY = _shared_registry()
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of every thread at an interval, switched on at runtime.
+
+    The samples are aggregated as collapsed stacks ("frame;frame;frame count" lines),
+    the input of flamegraph.pl and speedscope.  Only the sampling thread runs while
+    profiling, nothing is hooked into the profiled code.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        """
+        :param interval:    the seconds between two samples
+        :param max_depth:   the number of innermost frames kept per stack
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+
+    def _stack(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+    def profile(self, seconds):
+        """ Samples for a number of seconds, one profile at a time.
+
+            :returns stacks:    the collapsed stacks, most sampled first
+        """
+        with self._lock:
+            counts = collections.Counter()
+            own = threading.get_ident()
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        counts[self._stack(frame)] += 1
+                time.sleep(self.interval)
+        return '\n'.join('{} {}'.format(stack, count)
+                         for stack, count in counts.most_common()) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            body = self.server.registry.render()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif url.path == '/profile' and self.server.profiler is not None:
+            try:
+                seconds = min(float(parse_qs(url.query).get('seconds', ['10'])[0]), 300.0)
+            except ValueError:
+                self.send_error(400, 'seconds must be a number')
+                return
+            body = self.server.profiler.profile(seconds)
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from {}: {}'.format(self.client_address[0], format % args))
+
+
+def serve(port, host='127.0.0.1', registry=REGISTRY, profiler=None):
+    """ Serves /metrics, and /profile?seconds=N when a profiler is given, from a
+        daemon thread.
+
+        :returns server:    the ThreadingHTTPServer, stopped with shutdown()
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.registry = registry
+    server.profiler = profiler
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logger.info('Serving metrics on http://{}:{}/metrics'.format(host, server.server_port))
+    return server
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import os
+import queue
+import socket
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+NEW_EVENTS = b'E'
+
+
+class Notifier(object):
+    """Signals that new events were written to the DB.
+
+    Producers in the controller's process put the signal straight on the Processor's
+    queue, producers in other processes send it as a datagram to the unix socket the
+    controller's Listener is bound to.  A signal is only a hint: it carries no data and
+    is dropped silently when nobody listens, the Processor's slow DB poll picks the
+    events up then.
+    """
+
+    def __init__(self, event_queue=None, address=None):
+        """
+        :param event_queue:     the queue.Queue the Processor waits on, in-process only
+        :param address:         the path of the Listener's unix datagram socket
+        """
+        self.event_queue = event_queue
+        self.address = address
+        self._sock = None
+        if address and event_queue is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+
+
+    def notify(self):
+        if self.event_queue is not None:
+            self.event_queue.put_nowait(NEW_EVENTS)
+        elif self._sock is not None:
+            try:
+                self._sock.sendto(NEW_EVENTS, self.address)
+            except OSError as e:
+                # Listener not running or its buffer is full of earlier signals
+                logger.debug('Failed to signal new events to {}: {}'.format(self.address, e))
+
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class Listener(threading.Thread):
+    """Relays signals sent to a unix datagram socket onto the Processor's queue."""
+
+    def __init__(self, event_queue, address):
+        """
+        :param event_queue:     the queue.Queue the Processor waits on
+        :param address:         the path the socket is bound to, replaced if it exists
+        """
+        super(Listener, self).__init__(name='event-listener')
+        self.daemon = True
+        self.event_queue = event_queue
+        self.address = address
+        self.shutting_down = threading.Event()
+        if os.path.exists(address):
+            os.remove(address)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(address)
+        self._sock.settimeout(1.0)
+
+
+    def run(self):
+        while not self.shutting_down.is_set():
+            try:
+                self._sock.recv(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            # Signals only need to wake the Processor, one queued is as good as many
+            if self.event_queue.empty():
+                self.event_queue.put_nowait(NEW_EVENTS)
+
+
+    def shutdown(self):
+        self.shutting_down.set()
+        if self.is_alive():
+            self.join()
+        self._sock.close()
+        try:
+            os.remove(self.address)
+        except OSError:
+            pass
+
+
+def drain(event_queue):
+    """ Discards the signals queued so far, they are all served by the next claim. """
+    try:
+        while True:
+            event_queue.get_nowait()
+    except queue.Empty:
+        pass
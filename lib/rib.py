@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class AdjRibIn(object):
+    """Hash-indexed store of BGP-LU routes learned from ExaBGP, keyed by route-key."""
+
+    def __init__(self):
+        self._routes = dict()
+        self._stale = set()
+        self.stale_since = None
+
+
+    def __len__(self):
+        return len(self._routes)
+
+
+    def __contains__(self, route_key):
+        return route_key in self._routes
+
+
+    def __iter__(self):
+        return iter(self._routes.values())
+
+
+    def announce(self, route_key, route):
+        """ Installs a route, implicitly withdrawing any route with the same key.
+
+            :param route_key:   the key returned by Controller._route_key()
+            :param route:       the route to install
+            :returns route:     the route that was replaced, or None
+        """
+        previous = self._routes.get(route_key)
+        self._routes[route_key] = route
+        if self._stale:
+            self._stale.discard(route_key)
+        return previous
+
+
+    def withdraw(self, route_key):
+        """ Removes a route.
+
+            :param route_key:   the key returned by Controller._route_key()
+            :returns route:     the route that was removed, or None if unknown
+        """
+        route = self._routes.pop(route_key, None)
+        if self._stale:
+            self._stale.discard(route_key)
+        if route is None:
+            logger.debug('Withdraw for unknown route {}'.format(route_key))
+        return route
+
+
+    def get(self, route_key, default=None):
+        """ Gets a route by its key. """
+        return self._routes.get(route_key, default)
+
+
+    def keys(self):
+        return self._routes.keys()
+
+
+    def routes(self):
+        return self._routes.values()
+
+
+    def items(self):
+        return self._routes.items()
+
+
+    def clear(self):
+        """ Removes every route and returns how many were dropped. """
+        count = len(self._routes)
+        self._routes = dict()
+        self._stale = set()
+        self.stale_since = None
+        return count
+
+
+    def is_stale(self, route_key):
+        return route_key in self._stale
+
+
+    def stale_count(self):
+        return len(self._stale)
+
+
+    def mark_stale(self, now):
+        """ Marks every route stale, keeping it installed until refreshed or swept.
+
+            :param now:         the time the session went down
+            :returns count:     the number of routes marked stale
+        """
+        self._stale = set(self._routes)
+        self.stale_since = now if self._stale else None
+        return len(self._stale)
+
+
+    def sweep(self):
+        """ Removes every route still stale in one batch.
+
+            :returns routes:    a list of (route_key, route) tuples that were removed
+        """
+        swept = [(route_key, self._routes.pop(route_key)) for route_key in self._stale]
+        self._stale = set()
+        self.stale_since = None
+        return swept
+
+
+class Rib(object):
+    """BGP-LU routes partitioned per neighbor, one AdjRibIn per peer address.
+
+    The routes are counted as they change, so the length is read without walking
+    the partitions, e.g. by the metrics thread while the controller changes them.
+    """
+
+    def __init__(self):
+        self._partitions = dict()
+        self._count = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+    def __iter__(self):
+        for partition in self._partitions.values():
+            for route in partition:
+                yield route
+
+
+    def peers(self):
+        return list(self._partitions)
+
+
+    def partition(self, peer):
+        """ Gets the AdjRibIn for a neighbor, creating an empty one if needed. """
+        partition = self._partitions.get(peer)
+        if partition is None:
+            partition = self._partitions[peer] = AdjRibIn()
+        return partition
+
+
+    def get_partition(self, peer):
+        """ Gets the AdjRibIn for a neighbor, or None if nothing was learned from it. """
+        return self._partitions.get(peer)
+
+
+    def announce(self, peer, route_key, route):
+        previous = self.partition(peer).announce(route_key, route)
+        if previous is None:
+            self._count += 1
+        return previous
+
+
+    def withdraw(self, peer, route_key):
+        partition = self._partitions.get(peer)
+        if partition is None:
+            logger.debug('Withdraw {} from unknown neighbor {}'.format(route_key, peer))
+            return None
+        route = partition.withdraw(route_key)
+        if route is not None:
+            self._count -= 1
+        return route
+
+
+    def get(self, peer, route_key, default=None):
+        partition = self._partitions.get(peer)
+        if partition is None:
+            return default
+        return partition.get(route_key, default)
+
+
+    def flush(self, peer):
+        """ Drops a neighbor's partition in bulk, leaving other neighbors untouched.
+
+            :param peer:        the neighbor address
+            :returns routes:    the AdjRibIn that was dropped, or None
+        """
+        partition = self._partitions.pop(peer, None)
+        if partition is not None:
+            self._count -= len(partition)
+        return partition
+
+
+    def mark_stale(self, peer, now):
+        """ Marks a neighbor's routes stale, see AdjRibIn.mark_stale(). """
+        partition = self._partitions.get(peer)
+        if partition is None:
+            return 0
+        return partition.mark_stale(now)
+
+
+    def sweep(self, peer):
+        """ Removes a neighbor's routes still stale, see AdjRibIn.sweep(). """
+        partition = self._partitions.get(peer)
+        if partition is None:
+            return []
+        swept = partition.sweep()
+        self._count -= len(swept)
+        return swept
+
+
+    def expired(self, now, stale_timer):
+        """ Gets the neighbors whose stale routes have outlived the stale timer. """
+        return [peer
+                for peer, partition in self._partitions.items()
+                    if partition.stale_since is not None and
+                       now - partition.stale_since >= stale_timer
+               ]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import socket
+import struct
+
+
+def ip_to_int(address):
+    """ Packs a dotted-quad IPv4 address into an integer. """
+    return struct.unpack('!I', socket.inet_aton(address))[0]
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def encode_prefix(prefix):
+    """ Packs "a.b.c.d/len" into one integer, the address shifted left by 6 bits
+        and the mask length in the low bits.
+    """
+    address, _, length = prefix.partition('/')
+    return (ip_to_int(address) << 6) | (int(length) if length else 32)
+
+
+def decode_prefix(network):
+    return '{}/{}'.format(int_to_ip(network >> 6), network & 0x3f)
+
+
+def route_key(network, nexthop):
+    """ Packs an encoded prefix and next-hop into the integer key used by the RIB. """
+    return (network << 32) | nexthop
+
+
+class LabeledRoute(object):
+    """Compact BGP-LU route record.
+
+    The prefix and next-hop are packed together into the integer route key, which is
+    also the key the RIB stores the route under.  The label stack and attributes are
+    references to interned LabelStack and AttributeSet entries.  to_odl() renders the
+    ODL-style dict on demand.
+    """
+
+    __slots__ = ('key', 'labels', 'attributes', 'peer')
+
+    def __init__(self, key, labels, attributes, peer):
+        """
+        :param key:         a prefix and next-hop packed by route_key()
+        :param labels:      an interned LabelStack
+        :param attributes:  an interned AttributeSet
+        :param peer:        the address of the neighbor the route was learned from
+        """
+        self.key = key
+        self.labels = labels
+        self.attributes = attributes
+        self.peer = peer
+
+
+    @property
+    def network(self):
+        return self.key >> 32
+
+
+    @property
+    def nexthop(self):
+        return self.key & 0xffffffff
+
+
+    @property
+    def address(self):
+        return self.key >> 38
+
+
+    @property
+    def length(self):
+        return (self.key >> 32) & 0x3f
+
+
+    @property
+    def prefix(self):
+        return decode_prefix(self.network)
+
+
+    @property
+    def nexthop_address(self):
+        return int_to_ip(self.nexthop)
+
+
+    @property
+    def odl_key(self):
+        return self.prefix + "_" + self.nexthop_address
+
+
+    def __eq__(self, other):
+        if not isinstance(other, LabeledRoute):
+            return NotImplemented
+        # Interned entries are identical unless one was released and interned again
+        return (self.key == other.key and self.peer == other.peer and
+                (self.labels is other.labels or self.labels.key == other.labels.key) and
+                (self.attributes is other.attributes or
+                 self.attributes.key == other.attributes.key))
+
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+    def __repr__(self):
+        return 'LabeledRoute({} via {}, labels={})'.format(
+            self.prefix, self.nexthop_address, list(self.labels.key))
+
+
+    def to_odl(self):
+        """ Renders the route in ODL format. """
+        prefix = self.prefix
+        nexthop = self.nexthop_address
+        attributes = self.attributes.to_odl()
+        attributes["ipv4-next-hop"] = {"global":nexthop}
+        return {
+                "route-key":self.odl_key,
+                "prefix":prefix,
+                "attributes":attributes,
+                "label_stack":self.labels.to_odl()
+               }
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EPER'
+JOURNAL_MAGIC = b'EPEJ'
+VERSION = 1
+
+# magic, version, tables length, record count
+HEADER = struct.Struct('<4sHII')
+# address, next-hop, mask length, peer index, label stack index, attribute set index
+RECORD = struct.Struct('<IIBHII')
+# operation followed by a RECORD
+JOURNAL_RECORD = struct.Struct('<BIIBHII')
+
+ANNOUNCE = 1
+WITHDRAW = 2
+
+
+def _tuplify(value):
+    if isinstance(value, list):
+        return tuple(_tuplify(item) for item in value)
+    return value
+
+
+class RibSnapshot(object):
+    """Periodic binary snapshot of the RIB, restored with mmap when the controller restarts.
+
+    The snapshot is a base file of fixed-size records plus a journal the changes since
+    the base are appended to on each checkpoint.  Peers, label stacks and attribute
+    sets are stored once in small JSON tables and referenced by index from the
+    records, so restoring does not parse anything per route.  The journal is folded
+    into a new base once it grows larger than half of it.
+    """
+
+    def __init__(self, path, interval=10.0):
+        """
+        :param path:        the base file, the journal is written next to it
+        :param interval:    the seconds between two checkpoints
+        """
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.interval = interval
+        self.deadline = time.time() + interval
+        self._dirty = dict()
+        self._reset_tables()
+
+
+    def _reset_tables(self):
+        self._tables = {"peers": dict(), "labels": dict(), "attributes": dict()}
+        self._new = {"peers": list(), "labels": list(), "attributes": list()}
+        self._base_count = 0
+        self._journal_count = 0
+
+
+    def _index(self, table, key):
+        index = self._tables[table].get(key)
+        if index is None:
+            index = self._tables[table][key] = len(self._tables[table])
+            self._new[table].append(key)
+        return index
+
+
+    def record(self, peer, route_key, route):
+        """ Notes that a route changed since the last checkpoint, route being None once
+            it was removed.
+        """
+        self._dirty[(peer, route_key)] = route
+
+
+    def load(self):
+        """ Reads the base file and journal.
+
+            :returns entries:   a generator of (operation, peer, address, length, nexthop,
+                                labels key, attributes key) tuples to apply in order
+        """
+        self._reset_tables()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as snapshot:
+            with mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, tables_length, count = HEADER.unpack_from(mm, 0)
+                if magic != MAGIC or version != VERSION:
+                    logger.warning('Ignoring snapshot {} with unknown format'.format(self.path))
+                    return
+                start = HEADER.size + tables_length
+                tables = self._load_tables(mm[HEADER.size:start])
+                self._base_count = count
+                with memoryview(mm)[start:start + count * RECORD.size] as records:
+                    for address, nexthop, length, peer, labels, attributes in RECORD.iter_unpack(records):
+                        yield (ANNOUNCE, tables["peers"][peer], address, length, nexthop,
+                               tables["labels"][labels], tables["attributes"][attributes])
+
+        for entry in self._load_journal():
+            yield entry
+        self._new = {"peers": list(), "labels": list(), "attributes": list()}
+        self._dirty = dict()
+
+
+    def discard(self):
+        """ Moves a snapshot that failed to load aside, the next checkpoint writing a
+            new base file.
+        """
+        self._reset_tables()
+        self._dirty = dict()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        if os.path.exists(self.path):
+            os.replace(self.path, self.path + '.bad')
+            logger.warning('Moved unreadable snapshot {} to {}.bad'.format(self.path, self.path))
+
+
+    def _load_tables(self, raw):
+        """ Decodes a table block, adding its entries after the ones already known. """
+        for table, keys in json.loads(bytes(raw)).items():
+            for key in keys:
+                self._index(table, key if table == "peers" else _tuplify(key))
+        return {table: list(index) for table, index in self._tables.items()}
+
+
+    def _load_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as journal:
+            data = journal.read()
+
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            magic, version, tables_length, count = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + tables_length + count * JOURNAL_RECORD.size
+            if magic != JOURNAL_MAGIC or version != VERSION or end > len(data):
+                logger.warning('Ignoring truncated journal {} after {} bytes'.format(
+                               self.journal_path, offset))
+                break
+            start = offset + HEADER.size + tables_length
+            tables = self._load_tables(data[offset + HEADER.size:start])
+            self._journal_count += count
+            for operation, address, nexthop, length, peer, labels, attributes in \
+                    JOURNAL_RECORD.iter_unpack(data[start:end]):
+                yield (operation, tables["peers"][peer], address, length, nexthop,
+                       tables["labels"][labels] if operation == ANNOUNCE else None,
+                       tables["attributes"][attributes] if operation == ANNOUNCE else None)
+            offset = end
+
+
+    def _tables_block(self):
+        raw = json.dumps(self._new).encode()
+        self._new = {"peers": list(), "labels": list(), "attributes": list()}
+        return raw
+
+
+    def _pack(self, peer, route):
+        return (route.address, route.nexthop, route.length, self._index("peers", peer),
+                self._index("labels", route.labels.key),
+                self._index("attributes", route.attributes.key))
+
+
+    def due(self, now=None):
+        return bool(self._dirty) and (now or time.time()) >= self.deadline
+
+
+    def checkpoint(self, rib):
+        """ Appends the changes since the last checkpoint to the journal, or writes a
+            new base file when there is none yet or the journal has grown too large.
+
+            :param rib:     the lib.rib.Rib the controller holds
+        """
+        self.deadline = time.time() + self.interval
+        if not self._dirty:
+            return
+        if not os.path.exists(self.path) or \
+                self._journal_count + len(self._dirty) > max(self._base_count, 10000) // 2:
+            self.write_base(rib)
+        else:
+            self.write_journal()
+
+
+    def write_base(self, rib):
+        self._reset_tables()
+        records = bytearray()
+        for route in rib:
+            records += RECORD.pack(*self._pack(route.peer, route))
+        tables = self._tables_block()
+
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as snapshot:
+            snapshot.write(HEADER.pack(MAGIC, VERSION, len(tables), len(records) // RECORD.size))
+            snapshot.write(tables)
+            snapshot.write(records)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        # The journal holds changes since the old base, it goes first so a crash in
+        # between never leaves it applied over the new one
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        os.replace(temporary, self.path)
+
+        self._base_count = len(records) // RECORD.size
+        self._dirty = dict()
+        logger.info('Wrote RIB snapshot of {} routes to {}'.format(self._base_count, self.path))
+
+
+    def write_journal(self):
+        records = bytearray()
+        for (peer, route_key), route in self._dirty.items():
+            if route is None:
+                network = route_key >> 32
+                records += JOURNAL_RECORD.pack(WITHDRAW, network >> 6, route_key & 0xffffffff,
+                                               network & 0x3f, self._index("peers", peer), 0, 0)
+            else:
+                records += JOURNAL_RECORD.pack(ANNOUNCE, *self._pack(peer, route))
+        tables = self._tables_block()
+        count = len(records) // JOURNAL_RECORD.size
+
+        with open(self.journal_path, 'ab') as journal:
+            journal.write(HEADER.pack(JOURNAL_MAGIC, VERSION, len(tables), count))
+            journal.write(tables)
+            journal.write(records)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        self._journal_count += count
+        self._dirty = dict()
+        logger.debug('Journaled {} RIB changes to {}'.format(count, self.journal_path))
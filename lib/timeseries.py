@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import threading
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class UtilizationStore(object):
+    """Recent utilization samples of every interface, in fixed-size NumPy ring buffers.
+
+    Each (device, interface) owns a row of a samples matrix holding its last window
+    samples, with its EWMA and the times of its last two samples kept alongside.
+    Detection runs over whole rows at once and flags an interface when
+
+        - at least required of its last window samples exceed the threshold and its
+          EWMA does too, i.e. a sustained breach, or
+        - its last two samples exceed the threshold and it rose by at least
+          surge_rate per second between them, i.e. a steep onset,
+
+    so a single spike never does.  Rows are allocated on first sight and the matrix
+    doubles when full.  The store is shared by the collector threads.
+    """
+
+    def __init__(self, threshold=10.0, window=5, required=3, alpha=0.3, surge_rate=0.5,
+                 capacity=1024):
+        """
+        :param threshold:   the utilization in percent an interface must exceed
+        :param window:      the number of samples kept per interface, M
+        :param required:    the samples of the window above threshold for a breach, N
+        :param alpha:       the weight of the newest sample in the EWMA
+        :param surge_rate:  the rise in percent per second flagging a steep onset
+        :param capacity:    the number of rows allocated up front
+        """
+        self.threshold = threshold
+        self.window = window
+        self.required = required
+        self.alpha = alpha
+        self.surge_rate = surge_rate
+        self._rows = dict()
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+
+    def __len__(self):
+        return len(self._rows)
+
+
+    def _allocate(self, capacity):
+        """ Sizes every column to capacity rows, keeping the rows already in use. """
+        used = len(self._rows)
+        columns = {
+            'samples': np.full((capacity, self.window), np.nan),
+            'positions': np.zeros(capacity, dtype=np.int64),
+            'counts': np.zeros(capacity, dtype=np.int64),
+            'ewma': np.zeros(capacity),
+            'times': np.zeros(capacity),
+            'previous_times': np.zeros(capacity),
+        }
+        for name, column in columns.items():
+            if used:
+                column[:used] = getattr(self, name)[:used]
+            setattr(self, name, column)
+
+
+    def _row(self, key):
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._rows)
+            if row == len(self.counts):
+                self._allocate(2 * row)
+            self._rows[key] = row
+        return row
+
+
+    def record(self, device, samples, now=None):
+        """ Appends one sample per interface of a device.
+
+            :param samples:     a list of (interface, utilization) tuples
+            :returns rows:      the rows of the interfaces, in the order of samples
+        """
+        if now is None:
+            now = time.time()
+        rows = np.array([self._row((device, interface)) for interface, value in samples],
+                        dtype=np.int64)
+        values = np.array([value for interface, value in samples], dtype=np.float64)
+
+        positions = self.positions[rows]
+        self.samples[rows, positions] = values
+        self.positions[rows] = (positions + 1) % self.window
+        self.ewma[rows] = np.where(self.counts[rows] == 0, values,
+                                   self.alpha * values + (1 - self.alpha) * self.ewma[rows])
+        self.counts[rows] += 1
+        self.previous_times[rows] = self.times[rows]
+        self.times[rows] = now
+        return rows
+
+
+    def detect(self, rows=None):
+        """ Evaluates the breach conditions of many interfaces in one pass.
+
+            :param rows:        an array of rows, defaults to every interface
+            :returns breached:  a boolean array, one entry per row
+        """
+        if rows is None:
+            rows = np.arange(len(self._rows))
+        samples = self.samples[rows]
+        # NaN marks slots not filled yet and compares False
+        above = samples > self.threshold
+        sustained = (above.sum(axis=1) >= self.required) & (self.ewma[rows] > self.threshold)
+
+        index = np.arange(len(rows))
+        latest = self.positions[rows] - 1
+        previous = self.positions[rows] - 2
+        rise = samples[index, latest % self.window] - samples[index, previous % self.window]
+        elapsed = self.times[rows] - self.previous_times[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where((self.counts[rows] >= 2) & (elapsed > 0), rise / elapsed, 0.0)
+        surging = (above[index, latest % self.window] & above[index, previous % self.window] &
+                   (rate >= self.surge_rate))
+        return sustained | surging
+
+
+    def update(self, device, samples, now=None):
+        """ Records a device's samples and flags the interfaces in breach.
+
+            :param samples:     a list of (interface, utilization) tuples
+            :returns breached:  a list of booleans, in the order of samples
+        """
+        if not samples:
+            return []
+        with self._lock:
+            return self.detect(self.record(device, samples, now)).tolist()
+
+
+    def breaches(self):
+        """ Gets every (device, interface) currently in breach. """
+        with self._lock:
+            breached = self.detect()
+            return [key for key, row in self._rows.items() if breached[row]]
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+
+MASKS = [((1 << length) - 1) << (32 - length) for length in range(33)]
+
+
+def _bit(address, position):
+    return (address >> (31 - position)) & 1
+
+
+def _common_length(address1, address2, limit):
+    common = 32 - (address1 ^ address2).bit_length()
+    return common if common < limit else limit
+
+
+class _Node(object):
+
+    __slots__ = ('address', 'length', 'left', 'right', 'value')
+
+    def __init__(self, address, length, value=None):
+        self.address = address
+        self.length = length
+        self.left = None
+        self.right = None
+        self.value = value
+
+
+    def child(self, address):
+        return self.right if _bit(address, self.length) else self.left
+
+
+    def set_child(self, node):
+        if _bit(node.address, self.length):
+            self.right = node
+        else:
+            self.left = node
+
+
+class PrefixTrie(object):
+    """Path-compressed binary (Patricia) trie over IPv4 prefixes.
+
+    Prefixes are (address, length) pairs with the address as an integer.  Exact match,
+    longest-prefix match and subtree enumeration walk at most one node per bit of the
+    prefix.  Nodes without a value are only kept to join two branches.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._count = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+    def __iter__(self):
+        return self._walk(self._root)
+
+
+    def _replace(self, parent, old, new):
+        if parent is None:
+            self._root = new
+        elif parent.left is old:
+            parent.left = new
+        else:
+            parent.right = new
+
+
+    def insert(self, address, length, value):
+        """ Sets the value stored for a prefix, adding the prefix if needed. """
+        address &= MASKS[length]
+        parent = None
+        node = self._root
+        while node is not None:
+            common = _common_length(node.address, address,
+                                    node.length if node.length < length else length)
+            if common < node.length:
+                # The new prefix branches off above this node
+                if common == length:
+                    new = _Node(address, length, value)
+                    new.set_child(node)
+                else:
+                    new = _Node(address & MASKS[common], common)
+                    new.set_child(node)
+                    new.set_child(_Node(address, length, value))
+                self._replace(parent, node, new)
+                self._count += 1
+                return
+            if node.length == length:
+                if node.value is None:
+                    self._count += 1
+                node.value = value
+                return
+            parent = node
+            node = node.right if (address >> (31 - node.length)) & 1 else node.left
+
+        new = _Node(address, length, value)
+        if parent is None:
+            self._root = new
+        else:
+            parent.set_child(new)
+        self._count += 1
+
+
+    def get(self, address, length, default=None):
+        """ Exact match. """
+        address &= MASKS[length]
+        node = self._root
+        while node is not None and node.length <= length:
+            if node.address != address & MASKS[node.length]:
+                break
+            if node.length == length:
+                return default if node.value is None else node.value
+            node = node.right if (address >> (31 - node.length)) & 1 else node.left
+        return default
+
+
+    def remove(self, address, length):
+        """ Removes a prefix and collapses the nodes left without a purpose.
+
+            :returns value:     the value that was stored, or None
+        """
+        address &= MASKS[length]
+        grandparent = None
+        parent = None
+        node = self._root
+        while node is not None and node.length < length:
+            if node.address != address & MASKS[node.length]:
+                return None
+            grandparent, parent = parent, node
+            node = node.child(address)
+        if node is None or node.length != length or node.address != address or node.value is None:
+            return None
+
+        value = node.value
+        node.value = None
+        self._count -= 1
+
+        if node.left is not None and node.right is not None:
+            return value
+        if node.left is not None or node.right is not None:
+            self._replace(parent, node, node.left or node.right)
+            return value
+
+        self._replace(parent, node, None)
+        if parent is not None and parent.value is None:
+            self._replace(grandparent, parent, parent.left or parent.right)
+        return value
+
+
+    def lookup(self, address):
+        """ Longest-prefix match for a host address.
+
+            :returns entry:     an (address, length, value) tuple, or None
+        """
+        best = None
+        node = self._root
+        while node is not None and node.address == address & MASKS[node.length]:
+            if node.value is not None:
+                best = node
+            if node.length == 32:
+                break
+            node = node.child(address)
+        if best is None:
+            return None
+        return best.address, best.length, best.value
+
+
+    def covering(self, address, length):
+        """ Gets every stored prefix equal to or less specific than a prefix, shortest first. """
+        address &= MASKS[length]
+        node = self._root
+        while node is not None and node.length <= length and \
+                node.address == address & MASKS[node.length]:
+            if node.value is not None:
+                yield node.address, node.length, node.value
+            if node.length == length:
+                break
+            node = node.child(address)
+
+
+    def subtree(self, address, length):
+        """ Gets every stored prefix equal to or more specific than a prefix. """
+        address &= MASKS[length]
+        node = self._root
+        while node is not None:
+            if node.length >= length:
+                if node.address & MASKS[length] == address:
+                    return self._walk(node)
+                break
+            if node.address != address & MASKS[node.length]:
+                break
+            node = node.child(address)
+        return iter(())
+
+
+    @staticmethod
+    def _walk(node):
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                yield node.address, node.length, node.value
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+ANNOUNCE = 'announce'
+WITHDRAW = 'withdraw'
+
+
+class CommandWriter(object):
+    """Queues route commands for ExaBGP and writes them to its API pipe in batches.
+
+    Commands are keyed by prefix, so a newer command for a prefix replaces one not
+    written yet and a withdraw cancels an announce ExaBGP never saw.  Commands with
+    the same next-hop, labels and attributes are merged into one
+    "announce attributes ... nlri <prefix> <prefix> ..." line.  Writes never block:
+    whatever the pipe does not accept stays buffered, and no new commands are
+    rendered while the buffer is above its high-water mark.
+    """
+
+    MAX_NLRI = 256
+    HIGH_WATER = 1 << 20
+
+    def __init__(self, fd, max_nlri=MAX_NLRI, high_water=HIGH_WATER):
+        """
+        :param fd:          a writable file descriptor, e.g. sys.stdout.fileno()
+        :param max_nlri:    the number of prefixes merged into one command line at most
+        :param high_water:  the number of buffered bytes above which rendering pauses
+        """
+        self.fd = fd
+        self.max_nlri = max_nlri
+        self.high_water = high_water
+        self._pending = dict()
+        self._advertised = dict()
+        self._buffer = bytearray()
+        os.set_blocking(fd, False)
+
+
+    def fileno(self):
+        return self.fd
+
+
+    def backlog(self):
+        """ The number of queued commands and buffered bytes not written yet. """
+        return len(self._pending), len(self._buffer)
+
+
+    def wants_write(self):
+        return bool(self._buffer or self._pending)
+
+
+    def announce(self, prefix, nexthop, labels=(), attributes=''):
+        """ Queues an announce, superseding any command still queued for the prefix.
+
+            :param prefix:      "a.b.c.d/len"
+            :param nexthop:     the next-hop address
+            :param labels:      the MPLS label stack
+            :param attributes:  extra ExaBGP attribute syntax, e.g. "local-preference 200"
+        """
+        route = (nexthop, tuple(labels), attributes)
+        if self._advertised.get(prefix) == route:
+            self._pending.pop(prefix, None)
+        else:
+            self._pending[prefix] = (ANNOUNCE, route)
+
+
+    def withdraw(self, prefix):
+        """ Queues a withdraw, or cancels the queued announce if ExaBGP never saw it. """
+        if prefix in self._advertised:
+            self._pending[prefix] = (WITHDRAW, self._advertised[prefix])
+        else:
+            self._pending.pop(prefix, None)
+
+
+    @staticmethod
+    def _command(action, route, prefixes):
+        nexthop, labels, attributes = route
+        words = [action, 'attributes', 'next-hop', nexthop]
+        if labels:
+            words.append('label [ {} ]'.format(' '.join(str(label) for label in labels)))
+        if attributes:
+            words.append(attributes)
+        words.append('nlri')
+        words.extend(prefixes)
+        return ' '.join(words) + '\n'
+
+
+    def _render(self):
+        """ Moves queued commands into the output buffer, batched by shared attributes. """
+        groups = dict()
+        for prefix, (action, route) in self._pending.items():
+            groups.setdefault((action, route), []).append(prefix)
+            if action == ANNOUNCE:
+                self._advertised[prefix] = route
+            else:
+                self._advertised.pop(prefix, None)
+        self._pending = dict()
+
+        lines = list()
+        for (action, route), prefixes in groups.items():
+            for start in range(0, len(prefixes), self.max_nlri):
+                lines.append(self._command(action, route, prefixes[start:start + self.max_nlri]))
+        self._buffer += ''.join(lines).encode()
+
+
+    def flush(self):
+        """ Writes as much as the pipe accepts without blocking.
+
+            :returns written:   the number of bytes written
+        """
+        if self._pending and len(self._buffer) < self.high_water:
+            self._render()
+
+        written = 0
+        while self._buffer:
+            try:
+                count = os.write(self.fd, self._buffer)
+            except BlockingIOError:
+                break
+            del self._buffer[:count]
+            written += count
+        return written
@@ -3,6 +3,43 @@
 CONFIG = {
           'NLRI':'ipv4 nlri-mpls',
           'LOGFILE': '/home/amit/Code/sdn/log/exabgp.log',
+          'LOG_LEVEL': 'INFO',
           'DEVICES': ['3.3.3.3', '4.4.4.4'],
+          'GRACEFUL_RESTART': False,
+          'STALE_TIMER': 120,
+          'CHANGESET_URL': None,
+          'CHANGESET_WINDOW': 0.5,
+          'CHANGESET_MAX': 10000,
+          'SNAPSHOT_FILE': '/home/amit/Code/sdn/log/rib.snap',
+          'SNAPSHOT_INTERVAL': 10,
+          'EVENT_SOCKET': '/home/amit/Code/sdn/log/events.sock',
+          'DEDUP_TTL': 300,
+          'DEDUP_SIZE': 10000,
+          'POLL_INTERVAL': 60,
+          'POLL_JITTER': 5,
+          'POLL_TIMEOUT': 30,
+          'POLL_CONCURRENCY': 16,
+          # per-device overrides, e.g. {'3.3.3.3': {'interval': 30, 'jitter': 2}}
+          'DEVICE_SCHEDULES': {},
+          # interface role to the pattern searched for in its description, case-insensitively
+          'INTERFACE_ROLES': {'transit': r'transit', 'peer': r'peer'},
+          'UTILIZATION_THRESHOLD': 10.0,
+          # a breach needs BREACH_SAMPLES of the last BREACH_WINDOW samples above threshold
+          'BREACH_WINDOW': 5,
+          'BREACH_SAMPLES': 3,
+          'EWMA_ALPHA': 0.3,
+          # percent per second between two samples above threshold
+          'SURGE_RATE': 0.5,
+          # device to interface to the egress peer next-hops behind it,
+          # e.g. {'3.3.3.3': {'Ethernet1/1': ['192.0.2.1']}}
+          'EGRESS_INTERFACES': {},
+          'STEERING_ATTRIBUTES': 'local-preference 200',
+          # seconds steering holds after the last event of an interface, above DEDUP_TTL
+          'STEERING_HOLD': 900,
+          # local Prometheus endpoints, None to disable
+          'METRICS_PORT': 9108,
+          'COLLECTOR_METRICS_PORT': 9109,
+          # serve /profile?seconds=N on the metrics port, sampling only while requested
+          'PROFILER': False,
          }
 